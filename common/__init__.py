@@ -0,0 +1,7 @@
+from .qubo_matrix import QUBOMatrix
+from .qubo_io import (open_text, load_qubo, save_qubo, read_qbin, write_qbin, read_mm,
+                      RowBlocks, dump_json, write_json)
+from .parallel import read_seed, run_reads, best_read
+from .instances import read_dimacs, read_qap
+from .graph import (incidence, segment_pairs, conflict_pairs, matching_qubo,
+                    EdgeSequence, prune_edges)
@@ -0,0 +1,237 @@
+from collections import deque
+import random
+
+import numpy as np
+
+
+def incidence(edges):
+    """辺のリストから頂点ごとの接続辺のCSR構造を作る．
+
+    Args:
+        edges: (辺の数, 2)の端点の配列 (頂点は任意の整数)
+
+    Returns:
+        indptr, 接続辺の番号 (各頂点内で昇順)
+    """
+    edges = np.asarray(edges, dtype=np.int64).reshape(-1, 2)
+    m = len(edges)
+    _, node = np.unique(edges.ravel(), return_inverse=True)
+    eid = np.repeat(np.arange(m), 2)
+    order = np.lexsort((eid, node))
+    indptr = np.zeros(node.max(initial=-1) + 2, dtype=np.int64)
+    np.cumsum(np.bincount(node, minlength=len(indptr) - 1), out=indptr[1:])
+    return indptr, eid[order]
+
+
+def segment_pairs(indptr, items):
+    """CSR構造の各区間 (indptr[v]からindptr[v+1]) の中の要素の組 (前, 後) をすべて列挙する．
+
+    Args:
+        indptr: 区間の境界
+        items: 要素の配列
+
+    Returns:
+        区間内で前にある要素の配列と後ろにある要素の配列
+    """
+    indptr = np.asarray(indptr, dtype=np.int64)
+    items = np.asarray(items)
+    end = np.repeat(indptr[1:], np.diff(indptr))
+    # 各位置pから同じ区間の後ろの位置p+1, ..., end-1との組を作る
+    count = end - 1 - np.arange(len(items))
+    first = np.repeat(np.arange(len(items)), count)
+    start = np.repeat(np.cumsum(count) - count, count)
+    second = first + np.arange(len(first)) - start + 1
+    return items[first], items[second]
+
+
+def conflict_pairs(edges):
+    """端点を共有する辺の組 (a < b) を，頂点ごとの接続辺の組として列挙する．
+
+    計算量は各頂点の次数の2乗の和に比例する．
+
+    Args:
+        edges: (辺の数, 2)の端点の配列
+
+    Returns:
+        辺の番号の配列a, b ((a, b)の昇順，重複なし)
+    """
+    m = len(edges)
+    a, b = segment_pairs(*incidence(edges))
+    key = np.unique((a * m + b)[a != b])
+    return key // m, key % m
+
+
+def matching_qubo(edges, weights, penalty: int):
+    """重み付き辺のリストから最大重みマッチングのQUBOを作る．
+
+    ビットは辺の番号で，対角は-weight，端点を共有する辺の組はpenaltyとし，0の要素は除く．
+
+    Args:
+        edges: (辺の数, 2)の端点の配列
+        weights: 辺の重み
+        penalty (int): 端点を共有する辺を同時に選んだときのペナルティ
+
+    Returns:
+        (x, y)の昇順に並べた[x, y, v]のint64配列
+    """
+    m = len(edges)
+    a, b = conflict_pairs(edges)
+    row = np.concatenate((np.arange(m), a))
+    col = np.concatenate((np.arange(m), b))
+    val = np.concatenate((-np.asarray(weights, dtype=np.int64).reshape(m), np.full(len(a), penalty, dtype=np.int64)))
+    order = np.lexsort((col, row))
+    triples = np.stack((row[order], col[order], val[order]), axis=1)
+    return triples[triples[:, 2] != 0]
+
+
+class EdgeSequence:
+
+    def __init__(self, G):
+        """list(G.edges())と同じ順序で辺を返す列
+
+        networkxのGraphでは，辺(u, v)は頂点の順序で先に来るuの隣接辺として，隣接辞書での順に列挙される．
+        取り除いた辺を戻すと両端の隣接辞書の末尾に入る．各頂点の前向きの隣接頂点のリストと，
+        その長さのFenwick木を持ち，番号から辺をO(log n + 次数)で求める．
+        G自体の更新はremove/addとは別に行うこと．
+
+        Args:
+            G: networkxのGraph
+        """
+        self.pos = {u: i for i, u in enumerate(G.nodes())}
+        self.nodes = list(G.nodes())
+        self.forward = [[v for v in G.adj[u] if self.pos[v] > self.pos[u]] for u in self.nodes]
+        self.size = len(self.nodes)
+        self.tree = [0] * (self.size + 1)
+        self.total = 0
+        for i, f in enumerate(self.forward):
+            self._update(i, len(f))
+
+    def _update(self, i: int, d: int) -> None:
+        self.total += d
+        i += 1
+        while i <= self.size:
+            self.tree[i] += d
+            i += i & -i
+
+    def __len__(self) -> int:
+        return self.total
+
+    def __getitem__(self, k: int):
+        if k < 0:
+            k += self.total
+        if not 0 <= k < self.total:
+            raise IndexError('edge index out of range')
+        # 前向きの辺の数の累積がkを超える最初の頂点を探す
+        i = 0
+        step = 1 << self.size.bit_length()
+        while step > 0:
+            if i + step <= self.size and self.tree[i + step] <= k:
+                i += step
+                k -= self.tree[i]
+            step >>= 1
+        return self.nodes[i], self.forward[i][k]
+
+    def _order(self, u, v):
+        return (u, v) if self.pos[u] < self.pos[v] else (v, u)
+
+    def remove(self, u, v) -> None:
+        u, v = self._order(u, v)
+        self.forward[self.pos[u]].remove(v)
+        self._update(self.pos[u], -1)
+
+    def add(self, u, v) -> None:
+        u, v = self._order(u, v)
+        self.forward[self.pos[u]].append(v)
+        self._update(self.pos[u], 1)
+
+
+def _spanning_tree(G, root):
+    """rootからの幅優先探索木を{頂点: 親}で返す．"""
+    parent = {root: None}
+    queue = deque([root])
+    while queue:
+        x = queue.popleft()
+        for y in G.adj[x]:
+            if y not in parent:
+                parent[y] = x
+                queue.append(y)
+    return parent
+
+
+def _augment(G, mate, s) -> bool:
+    """2部グラフで自由頂点sからの増加路を幅優先で探し，見つかればmateを更新してTrueを返す．"""
+    reached = {}  # 内側の頂点 -> それに到達した外側の頂点
+    seen = {s}
+    queue = deque([s])
+    while queue:
+        x = queue.popleft()
+        for w in G.adj[x]:
+            if w in reached or w == s:
+                continue
+            reached[w] = x
+            if w not in mate:
+                while True:
+                    x = reached[w]
+                    y = mate.get(x)
+                    mate[x] = w
+                    mate[w] = x
+                    if y is None:
+                        return True
+                    w = y
+            y = mate[w]
+            if y not in seen:
+                seen.add(y)
+                queue.append(y)
+    return False
+
+
+def prune_edges(G, edges_num: int, rng=random, perfect_matching: int = None) -> None:
+    """連結性 (と最大マッチングの大きさ) を保ちながら，辺の数がedges_numになるまでランダムに辺を取り除く．
+
+    rng.choice(list(G.edges()))で辺を選んで取り除き，グラフが非連結になるか，最大マッチングの大きさが
+    perfect_matchingでなくなるなら戻す処理と，同じ乱数列に対して同じグラフを返す．
+    list(G.edges())の代わりにEdgeSequenceを使い，連結性は幅優先探索木に含まれる辺を取り除いたときだけ
+    木を作り直して確認する．最大マッチングは保持しておき，マッチングの辺を取り除いたときだけ
+    その両端からの増加路で修復する．
+
+    Args:
+        G: networkxのGraph (その場で変更する)
+        edges_num (int): 残す辺の数
+        rng: 乱数生成器 (randomモジュールまたはrandom.Random)
+        perfect_matching (int): 保つ最大マッチングの大きさ (Noneならマッチングは確認しない)
+    """
+    if G.number_of_edges() <= edges_num:
+        return
+    if edges_num < G.number_of_nodes() - 1:
+        raise ValueError(f'a connected graph with {G.number_of_nodes()} nodes needs at least {G.number_of_nodes() - 1} edges')
+    root = next(iter(G.nodes()))
+    parent = _spanning_tree(G, root)
+    if len(parent) != G.number_of_nodes():
+        raise ValueError('graph is not connected, so no edge can be removed')
+    mate = None
+    if perfect_matching is not None:
+        import networkx as nx
+        mate = nx.bipartite.maximum_matching(G)
+        if len(mate) // 2 != perfect_matching:
+            raise ValueError(f'maximum matching is smaller than {perfect_matching}, so no edge can be removed')
+    edges = EdgeSequence(G)
+    while G.number_of_edges() > edges_num:
+        u, v = rng.choice(edges)
+        G.remove_edge(u, v)
+        edges.remove(u, v)
+        keep = True
+        if parent.get(u) == v or parent.get(v) == u:
+            tree = _spanning_tree(G, root)
+            if len(tree) == G.number_of_nodes():
+                parent = tree
+            else:
+                keep = False
+        if keep and mate is not None and mate.get(u) == v:
+            del mate[u], mate[v]
+            if not (_augment(G, mate, u) or _augment(G, mate, v)):
+                mate[u] = v
+                mate[v] = u
+                keep = False
+        if not keep:
+            G.add_edge(u, v)
+            edges.add(u, v)
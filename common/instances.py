@@ -0,0 +1,101 @@
+import re
+
+import numpy as np
+
+from .qubo_io import open_text
+
+_CHUNK = 1 << 24  # 一度に読む文字数
+_VERTICES = re.compile(r'number of vertices\s*:\s*(\d+)')
+
+
+def _chunks(file, sep: str, chunk_size: int = _CHUNK):
+    """ファイルをchunk_size文字ずつ読み，最後のsepまでで区切った文字列を返す．"""
+    rest = ''
+    while True:
+        chunk = file.read(chunk_size)
+        if not chunk:
+            if rest:
+                yield rest
+            return
+        text = rest + chunk
+        cut = text.rfind(sep) + 1
+        yield text[:cut]
+        rest = text[cut:]
+
+
+def read_dimacs(fname: str):
+    """DIMACS形式のグラフを読み込む．.gzならgzipとして読む．
+
+    頂点数はコメント"c number of vertices  : N"から，なければ"p edge N M"の行から取る．
+    各辺(u, v)はu <= vとし，uの昇順に安定に並べる (同じuの辺はファイルでの順)．
+
+    Args:
+        fname (str): ファイル名
+
+    Returns:
+        頂点数と，1始まりの辺の(辺の数, 2)のint64配列
+    """
+    vertices_num = None
+    p_vertices = None
+    parts = []
+    with open_text(fname) as f:
+        for text in _chunks(f, '\n'):
+            body = text.rstrip('\n')
+            nline = body.count('\n') + 1
+            if ('\n' + body).count('\ne ') == nline:
+                # 辺の行だけのチャンクはまとめて変換する
+                edges = np.fromstring(body.replace('e', ' '), dtype=np.int64, sep=' ')
+                if len(edges) == 2 * nline:
+                    parts.append(edges)
+                    continue
+            edges = []
+            for line in text.splitlines():
+                if line.startswith('e '):
+                    edges.extend(line.split()[1:3])
+                elif line.startswith('c') and vertices_num is None:
+                    m = _VERTICES.search(line)
+                    if m is not None:
+                        vertices_num = int(m.group(1))
+                elif line.startswith('p') and p_vertices is None:
+                    p_vertices = int(line.split()[2])
+            if edges:
+                parts.append(np.array(edges, dtype=np.int64))
+    if vertices_num is None:
+        vertices_num = p_vertices
+    if vertices_num is None:
+        raise ValueError(f'{fname} does not have the number of vertices')
+    edges = np.concatenate(parts).reshape(-1, 2) if parts else np.zeros((0, 2), dtype=np.int64)
+    edges.sort(axis=1)
+    return vertices_num, edges[np.lexsort((edges[:, 0],))]
+
+
+def read_qap(fname: str):
+    """QAPLIB形式のQAPを読み込む．.gzならgzipとして読む．
+
+    最初の数がサイズnで，続くn*n個が行列A，その次のn*n個が行列Bである．
+
+    Args:
+        fname (str): ファイル名
+
+    Returns:
+        n, A, B (int64の(n, n)配列)
+    """
+    values = None
+    filled = 0
+    with open_text(fname) as f:
+        for text in _chunks(f, '\n'):
+            tokens = np.fromstring(text, dtype=np.int64, sep=' ') if text.strip() else np.zeros(0, dtype=np.int64)
+            if values is None:
+                if len(tokens) == 0:
+                    continue
+                n = int(tokens[0])
+                values = np.empty(2 * n * n, dtype=np.int64)
+                tokens = tokens[1:]
+            tokens = tokens[:len(values) - filled]
+            values[filled:filled + len(tokens)] = tokens
+            filled += len(tokens)
+            if filled == len(values):
+                break
+    if values is None or filled < len(values):
+        raise ValueError(f'{fname} is not a complete QAP instance')
+    return n, values[:n * n].reshape(n, n), values[n * n:].reshape(n, n)
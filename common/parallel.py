@@ -0,0 +1,90 @@
+import multiprocessing
+import os
+import tempfile
+
+import numpy as np
+
+from .qubo_io import is_qbin, read_qbin, write_qbin
+from .qubo_matrix import QUBOMatrix
+
+_matrix = None
+"""ワーカープロセスで共有するQUBO行列 (メモリマップ)
+"""
+
+
+def read_seed(seed: int, read: int) -> int:
+    """read番目の試行に使うシードを返す．試行をどう分割しても同じ値になる．
+
+    ソルバーによっては符号付き32ビットの範囲しか受け付けないため，31ビットに収める．
+
+    Args:
+        seed (int): 全体のシード
+        read (int): 試行の番号
+    """
+    return int(np.random.SeedSequence(seed, spawn_key=(read,)).generate_state(1)[0]) & 0x7fffffff
+
+
+def _init_worker(fname: str) -> None:
+    global _matrix
+    _matrix = read_qbin(fname)
+
+
+def _run_chunk(task):
+    func, reads, seed, args = task
+    return reads, func(_matrix, reads, seed, *args)
+
+
+def run_reads(func, matrix: QUBOMatrix, num_reads: int, workers: int, seed: int, args=(), fname: str = None,
+              block: int = 1):
+    """試行をworkers個のプロセスに分けて実行し，結果を試行の番号順にまとめる．
+
+    func(matrix, reads, seed, *args)はreadsに含まれる各試行を，その番号とseedだけから決まる乱数で実行し，
+    (len(reads), nbit)の解とそのエネルギーを返す関数とする．QUBO行列はバイナリ形式 (.qbin) の
+    ファイルを各ワーカーがメモリマップで開いて共有する．fnameが.qbinならそれを使い，そうでなければ
+    一時ファイルに書き出す．結果はworkersの値によらない．
+
+    funcが連続するblock個の試行 (番号 // blockが等しい試行) をまとめて1つのシードで実行する場合は
+    blockを指定する．プロセスへはブロックを分割せずに割り振る．
+
+    Args:
+        func: 試行を実行するモジュールレベルの関数
+        matrix (QUBOMatrix): QUBO行列
+        num_reads (int): 試行の数
+        workers (int): プロセス数
+        seed (int): 乱数のシード
+        args: funcに渡す残りの引数
+        fname (str): matrixを読み込んだファイル名
+        block (int): プロセスに割り振るときに分割しない試行の数
+
+    Returns:
+        (num_reads, nbit)のuint8配列の解と，int64のエネルギーの配列
+    """
+    nblock = -(-num_reads // block)
+    chunks = [list(range(c[0] * block, min((c[-1] + 1) * block, num_reads)))
+              for c in np.array_split(np.arange(nblock), max(1, min(workers, nblock))) if len(c) > 0]
+    samples = np.zeros((num_reads, matrix.nbit), dtype=np.uint8)
+    energies = np.zeros(num_reads, dtype=np.int64)
+    if len(chunks) <= 1:
+        results = [(reads, func(matrix, reads, seed, *args)) for reads in chunks]
+    else:
+        tmp = None
+        if not is_qbin(fname):
+            fd, tmp = tempfile.mkstemp(suffix='.qbin', dir='/dev/shm' if os.path.isdir('/dev/shm') else None)
+            os.close(fd)
+            write_qbin(matrix, tmp)
+            fname = tmp
+        try:
+            with multiprocessing.Pool(len(chunks), initializer=_init_worker, initargs=(fname,)) as pool:
+                results = pool.map(_run_chunk, [(func, reads, seed, args) for reads in chunks])
+        finally:
+            if tmp is not None:
+                os.remove(tmp)
+    for reads, (s, e) in results:
+        samples[reads] = s
+        energies[reads] = e
+    return samples, energies
+
+
+def best_read(energies) -> int:
+    """エネルギー最小の試行の番号を返す．同じエネルギーなら番号の小さい方とする．"""
+    return int(np.argmin(energies))
@@ -0,0 +1,28 @@
+import argparse
+import os
+import sys
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from common import load_qubo, save_qubo
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description='Convert QUBO files between JSON (.json/.json.gz) and binary (.qbin) formats',
+        epilog='the qbin file holds the matrix as a sorted upper triangle with duplicates summed. '
+               'if the JSON qubo is not in that form (e.g. lower-triangle terms), its original terms '
+               'are stored as well, so converting back to JSON reproduces them unchanged')
+    parser.add_argument('input', help='QUBO file to be read')
+    parser.add_argument('output', help='QUBO file to be written')
+    args = parser.parse_args()
+
+    try:
+        matrix = load_qubo(args.input, keep_order=True)
+    except ValueError as e:
+        print(e, file=sys.stderr)
+        sys.exit(1)
+    save_qubo(matrix, args.output)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,328 @@
+import gzip
+import json
+import numbers
+import re
+import struct
+import sys
+
+import numpy as np
+
+from .qubo_matrix import QUBOMatrix
+
+try:
+    import tqdm
+except ImportError:
+    tqdm = None
+
+QBIN_MAGIC = b'QUBOBIN1'
+"""バイナリ形式 (.qbin) のマジックナンバー
+"""
+_QBIN_HEADER = struct.Struct('<8sqqqq')  # magic, nbit, nnz, base, infoの長さ
+_INDENT = 4
+_CHUNK_ROWS = 1 << 16
+_MM_CHUNK = 1 << 24  # Matrix Marketを一度に読む文字数
+
+
+def open_text(fname: str, mode: str = 'rt'):
+    """テキストファイルを開く．.gzならgzipとして開き，Noneなら標準入出力を返す．
+
+    Args:
+        fname (str): ファイル名
+        mode (str): 'rt'または'wt'
+    """
+    if fname is None:
+        return sys.stdin if mode.startswith('r') else sys.stdout
+    if fname.lower().endswith('.gz'):
+        return gzip.open(fname, mode)
+    return open(fname, mode)
+
+
+class RowBlocks:
+
+    def __init__(self, blocks):
+        """dump_jsonでリストとして書き出す2次元整数配列の列
+
+        各ブロックの行を順に並べたリストとして出力する．全体を一度にメモリに置かずに
+        ブロックを生成しながら書き出すために使う．
+
+        Args:
+            blocks: (k, m)の整数配列を返すイテラブル，またはそれを返す引数なしの関数．
+                関数なら書き出すたびに呼び出すので，何度でも書き出せる
+        """
+        self.blocks = blocks
+
+    def __iter__(self):
+        return iter(self.blocks() if callable(self.blocks) else self.blocks)
+
+
+def _scalar(o) -> str:
+    if o is True or o is False or o is None or isinstance(o, (str, float)):
+        return json.dumps(o)
+    if isinstance(o, numbers.Integral):
+        return str(int(o))
+    if isinstance(o, numbers.Real):
+        return json.dumps(float(o))
+    raise TypeError(f'Object of type {type(o).__name__} is not JSON serializable')
+
+
+def _key(k) -> str:
+    if isinstance(k, str):
+        return json.dumps(k)
+    return json.dumps(_scalar(k))
+
+
+def _is_int_row(o) -> bool:
+    return type(o) in (list, tuple) and len(o) > 0 and all(type(v) is int for v in o)
+
+
+def _int_rows(rows, pre: str) -> str:
+    """整数の行のリストを"[x,y,v]"の形でカンマ区切りにする．"""
+    if len(rows[0]) == 3:
+        return ','.join([f'{pre}[{x},{y},{v}]' for x, y, v in rows])
+    return ','.join([pre + '[' + ','.join(map(str, r)) + ']' for r in rows])
+
+
+def _iter_rows(blocks, level: int):
+    pre = '\n' + ' ' * (_INDENT * (level + 1))
+    sep = '['
+    for block in blocks:
+        block = np.asarray(block)
+        for start in range(0, len(block), _CHUNK_ROWS):
+            rows = block[start:start + _CHUNK_ROWS].tolist()
+            if rows:
+                yield sep + _int_rows(rows, pre)
+                sep = ','
+    yield '[]' if sep == '[' else '\n' + ' ' * (_INDENT * level) + ']'
+
+
+def _iter_list(items, level: int):
+    """リストを出力する．数値の要素は前の改行と字下げを取り除き，
+    最後の要素が整数なら閉じ括弧の前の改行と字下げも取り除く．
+    """
+    if len(items) == 0:
+        yield '[]'
+        return
+    pre = '\n' + ' ' * (_INDENT * (level + 1))
+    buf = ['[']
+    last_int = False
+    for i, item in enumerate(items):
+        if i > 0:
+            buf.append(',')
+        last_int = False
+        if _is_int_row(item):
+            buf.append(pre + '[' + ','.join(map(str, item)) + ']')
+        elif isinstance(item, (dict, list, tuple, np.ndarray, RowBlocks)):
+            buf.append(pre)
+            yield ''.join(buf)
+            buf = []
+            yield from _iter_json(item, level + 1)
+        else:
+            token = _scalar(item)
+            if token[0].isdigit() or token[:1] == '-' and token[1:2].isdigit():
+                buf.append(token)
+                last_int = isinstance(item, numbers.Integral) and not isinstance(item, bool)
+            else:
+                buf.append(pre + token)
+        if len(buf) >= _CHUNK_ROWS:
+            yield ''.join(buf)
+            buf = []
+    buf.append(']' if last_int else '\n' + ' ' * (_INDENT * level) + ']')
+    yield ''.join(buf)
+
+
+def _iter_json(o, level: int = 0):
+    if isinstance(o, dict):
+        if not o:
+            yield '{}'
+            return
+        pre = '\n' + ' ' * (_INDENT * (level + 1))
+        sep = '{'
+        for k, v in o.items():
+            yield sep + pre + _key(k) + ': '
+            sep = ','
+            yield from _iter_json(v, level + 1)
+        yield '\n' + ' ' * (_INDENT * level) + '}'
+    elif isinstance(o, RowBlocks):
+        yield from _iter_rows(o, level)
+    elif isinstance(o, np.ndarray):
+        if o.ndim == 2 and o.dtype.kind in 'iu' and o.shape[1] > 0:
+            yield from _iter_rows([o], level)
+        else:
+            yield from _iter_list(o.tolist(), level)
+    elif isinstance(o, (list, tuple)):
+        yield from _iter_list(o, level)
+    else:
+        yield _scalar(o)
+
+
+def dump_json(obj, file) -> None:
+    """JSONをファイルに逐次書き出す．
+
+    出力はjson.dumps(obj, indent=4)に正規表現で数値の前後の改行と空白を取り除く処理を
+    施したもの (各[x, y, v]を1行に詰めた形式) とバイト単位で一致するが，文書全体の文字列は作らない．
+    RowBlocksや2次元の整数配列 (np.ndarray) はそのまま行のリストとして書き出す．
+
+    Args:
+        obj: 書き出すオブジェクト
+        file: 書き込み先のテキストファイル
+    """
+    for text in _iter_json(obj):
+        file.write(text)
+
+
+def write_json(obj, fname: str) -> None:
+    """JSONをファイルに書き出す．.gzで終わるならgzip圧縮する．
+
+    Args:
+        obj: 書き出すオブジェクト
+        fname (str): ファイル名
+    """
+    with open_text(fname, 'wt') as f:
+        dump_json(obj, f)
+
+
+def is_qbin(fname: str) -> bool:
+    return fname is not None and fname.lower().endswith('.qbin')
+
+
+def write_qbin(matrix: QUBOMatrix, fname: str) -> None:
+    """QUBO行列をバイナリ形式で書き出す．
+
+    ヘッダ (magic, nbit, nnz, base, infoの長さ) に続いて，offsetとqubo以外のフィールドを
+    保持するJSON (8バイト境界までスペースで埋める)，int32のrow, col，int64のvalを並べる．
+    row, colは0始まりの上三角で整列済みなので，読み込み時に並べ替えは不要である．
+    matrix.rawがあれば (元のJSONの要素が正規形でなければ)，infoのcanonicalをfalseとし，
+    その後ろに元の要素をint64の(nraw, 3)配列として並べる．
+
+    Args:
+        matrix (QUBOMatrix): 書き出す行列
+        fname (str): ファイル名
+    """
+    raw = matrix.raw
+    info = json.dumps({'offset': matrix.offset, 'qubo_index': matrix.qubo_index, 'meta': matrix.meta,
+                       'canonical': raw is None, 'nraw': 0 if raw is None else len(raw)}).encode()
+    info += b' ' * (-len(info) % 8)
+    with open(fname, 'wb') as f:
+        f.write(_QBIN_HEADER.pack(QBIN_MAGIC, matrix.nbit, matrix.nnz, matrix.base, len(info)))
+        f.write(info)
+        np.asarray(matrix.row, dtype='<i4').tofile(f)
+        np.asarray(matrix.col, dtype='<i4').tofile(f)
+        np.asarray(matrix.val, dtype='<i8').tofile(f)
+        if raw is not None:
+            np.asarray(raw, dtype='<i8').tofile(f)
+
+
+def read_qbin(fname: str, mmap: bool = True) -> QUBOMatrix:
+    """バイナリ形式のQUBOファイルを読み込む．
+
+    mmapがTrueならrow, col, valはnp.memmapとなり，ファイルサイズによらず一定時間で開ける．
+
+    Args:
+        fname (str): ファイル名
+        mmap (bool): メモリマップで開くか
+    """
+    with open(fname, 'rb') as f:
+        magic, nbit, nnz, base, info_len = _QBIN_HEADER.unpack(f.read(_QBIN_HEADER.size))
+        if magic != QBIN_MAGIC:
+            raise ValueError(f'{fname} is not a QUBO binary file')
+        info = json.loads(f.read(info_len))
+        start = _QBIN_HEADER.size + info_len
+        if mmap and nnz > 0:
+            row = np.memmap(f, dtype='<i4', mode='r', offset=start, shape=(nnz,))
+            col = np.memmap(f, dtype='<i4', mode='r', offset=start + 4 * nnz, shape=(nnz,))
+            val = np.memmap(f, dtype='<i8', mode='r', offset=start + 8 * nnz, shape=(nnz,))
+        else:
+            row = np.fromfile(f, dtype='<i4', count=nnz)
+            col = np.fromfile(f, dtype='<i4', count=nnz)
+            val = np.fromfile(f, dtype='<i8', count=nnz)
+        raw = None
+        if not info.get('canonical', True):
+            nraw = info['nraw']
+            if mmap and nraw > 0:
+                raw = np.memmap(f, dtype='<i8', mode='r', offset=start + 16 * nnz, shape=(nraw, 3))
+            else:
+                f.seek(start + 16 * nnz)
+                raw = np.fromfile(f, dtype='<i8', count=3 * nraw).reshape(-1, 3)
+    matrix = QUBOMatrix(nbit, row, col, val, base, info['offset'], info['meta'])
+    matrix.qubo_index = info['qubo_index']
+    matrix.raw = raw
+    return matrix
+
+
+def read_mm(file, chunk_size: int = _MM_CHUNK, progress: bool = True) -> QUBOMatrix:
+    """Matrix Market形式 (1行目が"nbit nelement"，以降"x y w"，1始まり) のQUBOを読み込む．
+
+    本体はchunk_size文字ずつまとめて読み，np.fromstringでそのまま配列に変換する．
+    進捗はチャンクごとに表示する．
+
+    Args:
+        file: テキストファイル (gzip.openしたものでもよい)
+        chunk_size (int): 一度に読む文字数
+        progress (bool): tqdmで進捗を表示するか
+    """
+    line = file.readline()
+    while line.startswith('%'):
+        line = file.readline()
+    m = re.match(r'\s*(\d+)\s+(\d+)', line)
+    if m is None:
+        raise ValueError('Matrix Market header "<nbit> <nelement>" is missing')
+    nbit = int(m.group(1))
+    nelement = int(m.group(2))
+    values = np.empty(3 * nelement, dtype=np.int64)
+    filled = 0
+    bar = None
+    if progress and tqdm is not None:
+        bar = tqdm.tqdm(total=nelement, desc='Reading', unit_scale=True)
+    rest = ''
+    while filled < len(values):
+        chunk = file.read(chunk_size)
+        text = rest + chunk
+        if chunk:
+            cut = text.rfind('\n') + 1
+            text, rest = text[:cut], text[cut:]
+        if text.strip():
+            parsed = np.fromstring(text, dtype=np.int64, sep=' ')[:len(values) - filled]
+            values[filled:filled + len(parsed)] = parsed
+            if bar is not None:
+                bar.update((filled + len(parsed)) // 3 - filled // 3)
+            filled += len(parsed)
+        if not chunk:
+            break
+    if bar is not None:
+        bar.close()
+    if filled < len(values):
+        raise ValueError(f'Matrix Market file has fewer than {nelement} elements')
+    return QUBOMatrix.from_triples(nbit, values.reshape(-1, 3), base=1)
+
+
+def load_qubo(fname: str, keep_order: bool = False) -> QUBOMatrix:
+    """QUBOファイル (.json/.json.gz/.mm/.mm.gz/.qbin) を読み込む．Noneなら標準入力からJSONを読む．
+
+    Args:
+        fname (str): ファイル名
+        keep_order (bool): JSONの要素の順序と向きを保持するか (QUBOMatrix.from_problemを参照)
+    """
+    if is_qbin(fname):
+        return read_qbin(fname)
+    if fname is not None and re.search(r'\.mm(\.gz)?$', fname, flags=re.IGNORECASE) is not None:
+        with open_text(fname) as file:
+            return read_mm(file)
+    if fname is not None and re.search(r'\.json(\.gz)?$', fname, flags=re.IGNORECASE) is None:
+        raise ValueError('QUBO Problem file must be .json, .json.gz, .mm, .mm.gz or .qbin')
+    with open_text(fname) as file:
+        problem = json.load(file)
+    return QUBOMatrix.from_problem(problem, keep_order)
+
+
+def save_qubo(matrix: QUBOMatrix, fname: str) -> None:
+    """QUBO行列を拡張子に応じた形式 (.json/.json.gz/.qbin) で書き出す．
+
+    Args:
+        matrix (QUBOMatrix): 書き出す行列
+        fname (str): ファイル名
+    """
+    if is_qbin(fname):
+        write_qbin(matrix, fname)
+        return
+    write_json(matrix.to_problem(), fname)
+
@@ -0,0 +1,251 @@
+import numpy as np
+
+_BATCH_ELEMENTS = 1 << 22  # energies/local_fieldで一度に作る (解, 要素) の組の数の上限
+
+class QUBOMatrix:
+
+    def __init__(self, nbit: int, row, col, val, base: int = 0, offset=0, meta=None):
+        """上三角COO形式のQUBO行列
+
+        row, colは0始まりで，row <= colかつ(row, col)の辞書順に整列済み，重複なしであること．
+        任意の入力からはfrom_coo/from_triplesを使って作成する．
+
+        Args:
+            nbit (int): ビット数
+            row: 行インデックス (int32)
+            col: 列インデックス (int32)
+            val: 重み (int64)
+            base (int): 元のファイルのインデックスの基数
+            offset: 定数項
+            meta (dict): qubo以外のフィールド
+        """
+        self.nbit = nbit
+        self.row = row
+        self.col = col
+        self.val = val
+        self.base = base
+        self.offset = offset
+        self.meta = {} if meta is None else meta
+        self.qubo_index = None
+        """JSONでquboフィールドが置かれていた位置 (Noneなら末尾)
+        """
+        self.raw = None
+        """元のファイルのquboの要素 ((n, 3)のint64配列，元の基数)．
+        元の要素が正規形 (上三角・整列済み・重複なし) でない場合だけ保持し，to_problemではこれをそのまま出力する．
+        """
+        self._adjacency = None
+        self._diagonal = None
+
+    @classmethod
+    def from_coo(cls, nbit: int, row, col, val, base: int = 0, offset=0, meta=None):
+        """任意の順序のCOO配列から作成する．
+
+        (y, x)は(x, y)に正規化し，同じ要素の重みは合計する．
+
+        Args:
+            nbit (int): ビット数
+            row: 0始まりの行インデックス
+            col: 0始まりの列インデックス
+            val: 重み
+        """
+        row = np.asarray(row, dtype=np.int64)
+        col = np.asarray(col, dtype=np.int64)
+        val = np.asarray(val, dtype=np.int64)
+        if len(row) > 0 and (min(row.min(), col.min()) < 0 or max(row.max(), col.max()) >= nbit):
+            raise ValueError(f'QUBO index out of range for nbit={nbit}')
+        row, col = np.minimum(row, col), np.maximum(row, col)
+        key = row * nbit + col
+        if np.any(key[1:] <= key[:-1]):
+            order = np.argsort(key, kind='stable')
+            key, row, col, val = key[order], row[order], col[order], val[order]
+            if np.any(key[1:] == key[:-1]):
+                first = np.flatnonzero(np.r_[True, key[1:] != key[:-1]])
+                row, col = row[first], col[first]
+                val = np.add.reduceat(val, first)
+        return cls(nbit, row.astype(np.int32), col.astype(np.int32), val, base, offset, meta)
+
+    @classmethod
+    def from_triples(cls, nbit: int, qubo, base: int = 0, offset=0, meta=None):
+        """[[x, y, v], ...]形式のリストから作成する．
+
+        Args:
+            nbit (int): ビット数
+            qubo: [x, y, v]のリスト
+            base (int): x, yの基数
+        """
+        triples = np.asarray(qubo, dtype=np.int64).reshape(-1, 3)
+        return cls.from_coo(nbit, triples[:, 0] - base, triples[:, 1] - base, triples[:, 2], base, offset, meta)
+
+    @classmethod
+    def from_dict(cls, nbit: int, W: dict, base: int = 0, offset=0, meta=None):
+        """{(x, y): v}形式の辞書から作成する．
+
+        Args:
+            nbit (int): ビット数
+            W (dict): 0始まりの(x, y)をキーとする重み
+            base (int): 元のファイルのインデックスの基数
+        """
+        key = np.array(list(W.keys()), dtype=np.int64).reshape(-1, 2)
+        val = np.fromiter(W.values(), dtype=np.int64, count=len(W))
+        return cls.from_coo(nbit, key[:, 0], key[:, 1], val, base, offset, meta)
+
+    @classmethod
+    def from_problem(cls, problem: dict, keep_order: bool = False):
+        """QUBO JSONを読み込んだ辞書から作成する．qubo以外のフィールドはmetaに残す．
+
+        行列は上三角に正規化し，同じ要素の重みは合計して整列する．keep_orderがTrueで
+        元の要素が正規形でなければ，元の順序と向きをrawに残してto_problemで復元できるようにする．
+
+        Args:
+            problem (dict): {"nbit", "base", "qubo", ...}
+            keep_order (bool): 元の要素の順序と向きを保持するか
+        """
+        nbit = problem.get('nbit')
+        if nbit is None:
+            raise ValueError('<nbit> is missing')
+        qubo = problem.get('qubo')
+        if qubo is None:
+            raise ValueError('<qubo> is missing')
+        base = problem.get('base')
+        if base is None:
+            base = 0
+        meta = {k: v for k, v in problem.items() if k != 'qubo'}
+        triples = np.asarray(qubo, dtype=np.int64).reshape(-1, 3)
+        matrix = cls.from_triples(nbit, triples, base, problem.get('offset', 0), meta)
+        matrix.qubo_index = list(problem).index('qubo')
+        if keep_order and not matrix._is_ordered(triples):
+            matrix.raw = triples
+        return matrix
+
+    def _is_ordered(self, triples) -> bool:
+        """[x, y, v]の配列が行列の要素とちょうど同じ順序と向きで並んでいるか"""
+        return (len(triples) == self.nnz and np.array_equal(triples[:, 0] - self.base, self.row)
+                and np.array_equal(triples[:, 1] - self.base, self.col))
+
+    def to_problem(self) -> dict:
+        """from_problemの逆．metaのフィールドと元の基数で表したquboからなる辞書を返す．
+
+        rawがあれば元の順序と向きのまま出力する．
+        """
+        items = list(self.meta.items())
+        index = len(items) if self.qubo_index is None else self.qubo_index
+        qubo = self.triples(self.base, nonzero=False) if self.raw is None else self.raw
+        items.insert(index, ('qubo', np.asarray(qubo).tolist()))
+        return dict(items)
+
+    @property
+    def nnz(self) -> int:
+        return len(self.val)
+
+    def eliminate_zeros(self):
+        """重みが0の要素を除いた行列を返す．"""
+        nz = self.val != 0
+        if nz.all():
+            return self
+        return QUBOMatrix(self.nbit, self.row[nz], self.col[nz], self.val[nz],
+                          self.base, self.offset, self.meta)
+
+    def diagonal(self):
+        """対角成分を長さnbitの配列で返す．"""
+        if self._diagonal is None:
+            d = np.zeros(self.nbit, dtype=np.int64)
+            on = self.row == self.col
+            d[self.row[on]] = self.val[on]
+            self._diagonal = d
+        return self._diagonal
+
+    def adjacency(self):
+        """非対角成分の対称なCSR隣接構造 (indptr, indices, data) を返す．
+
+        各行の隣接ビットは昇順に並ぶ．初回の呼び出しで作成し，以降は使い回す．
+        """
+        if self._adjacency is None:
+            off = self.row != self.col
+            r = np.concatenate((self.row[off], self.col[off]))
+            c = np.concatenate((self.col[off], self.row[off]))
+            v = np.concatenate((self.val[off], self.val[off]))
+            order = np.lexsort((c, r))
+            indptr = np.zeros(self.nbit + 1, dtype=np.int64)
+            np.cumsum(np.bincount(r, minlength=self.nbit), out=indptr[1:])
+            self._adjacency = (indptr, c[order], v[order])
+        return self._adjacency
+
+    def energy(self, solution) -> int:
+        """解のエネルギー (offsetを含まない) を返す．
+
+        Args:
+            solution: 長さnbitの0/1の列 (0始まり)
+        """
+        x = np.asarray(solution, dtype=bool)
+        on = x[self.row]
+        on &= x[self.col]
+        return int(self.val[on].sum())
+
+    def energies(self, samples):
+        """複数の解のエネルギー (offsetを含まない) をまとめて計算し，int64の配列で返す．
+
+        メモリを抑えるため，解をいくつかずつに分けて計算する．
+
+        Args:
+            samples: (解の数, nbit)のuint8/bool配列
+        """
+        X = np.asarray(samples)
+        if X.ndim == 1:
+            X = X.reshape(1, -1)
+        X = X.astype(bool, copy=False)
+        result = np.zeros(len(X), dtype=np.int64)
+        step = max(1, _BATCH_ELEMENTS // max(1, self.nnz))
+        for start in range(0, len(X), step):
+            on = X[start:start + step, self.row]
+            on &= X[start:start + step, self.col]
+            result[start:start + step] = on @ self.val
+        return result
+
+    def local_field(self, solution):
+        """各ビットの局所場 h_i = W_ii + sum_j W_ij x_j を返す．
+
+        ビットiを反転したときのエネルギーの変化は(1 - 2 x_i) h_i となる．
+        2次元の入力 (解の数, nbit) に対しては同じ形の配列を返す．
+        メモリを抑えるため，energiesと同じく解をいくつかずつに分けて計算する．
+
+        Args:
+            solution: 0/1の解，または解を並べた2次元配列
+        """
+        X = np.asarray(solution)
+        if X.ndim == 1:
+            return self.local_field(X.reshape(1, -1))[0]
+        indptr, indices, data = self.adjacency()
+        H = np.empty(X.shape, dtype=np.int64)
+        cs = None
+        step = max(1, _BATCH_ELEMENTS // max(1, len(data)))
+        for start in range(0, len(X), step):
+            prod = X[start:start + step, indices].astype(np.int64)
+            prod *= data
+            if cs is None or len(cs) != len(prod):
+                cs = np.zeros((len(prod), len(data) + 1), dtype=np.int64)
+            np.cumsum(prod, axis=1, out=cs[:, 1:])
+            H[start:start + step] = cs[:, indptr[1:]] - cs[:, indptr[:-1]]
+        H += self.diagonal()
+        return H
+
+    def triples(self, base: int = 0, nonzero: bool = True):
+        """(nnz, 3)のint64配列[x, y, v]として返す．
+
+        Args:
+            base (int): 出力するインデックスの基数
+            nonzero (bool): 重みが0の要素を除くか
+        """
+        m = self.eliminate_zeros() if nonzero else self
+        triples = np.empty((m.nnz, 3), dtype=np.int64)
+        triples[:, 0] = m.row
+        triples[:, 0] += base
+        triples[:, 1] = m.col
+        triples[:, 1] += base
+        triples[:, 2] = m.val
+        return triples
+
+    def to_dict(self, base=None) -> dict:
+        """{(x, y): v}形式の辞書を返す．キーは元のファイルの基数 (base) で表す．"""
+        if base is None:
+            base = self.base
+        return {(x, y): v for x, y, v in self.triples(base, nonzero=False).tolist()}
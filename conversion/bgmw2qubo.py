@@ -1,10 +1,14 @@
 from collections import defaultdict
 import argparse
 from typing import Tuple
-import re
-import json
 import networkx as nx
 import random
+import sys
+import os
+import numpy as np
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from common import matching_qubo, prune_edges, write_json
 
 
 def sort_pair(x: int, y: int):
@@ -23,7 +27,7 @@ def conflict(match0, match1):
 
 
 class Bigraph:
-    def __init__(self, m, n, p, edges_num, Min, Max, seed):
+    def __init__(self, m, n, p, edges_num, Min, Max, seed, legacy=False):
         # random.seed(seed)
         # self.G = nx.bipartite.random_graph(m, n, p, seed)
         # for u, v in self.G.edges():
@@ -37,15 +41,18 @@ class Bigraph:
         self.G = nx.bipartite.random_graph(m,n,p,seed)
         perfect_matching = min(m, n)
         #self.G = nx.bipartite.complete_bipartite_graph(m, n)
-        while self.G.number_of_edges() > edges_num:
-            u, v = random.choice(list(self.G.edges()))
-            self.G.remove_edge(u, v)
-            if not nx.is_connected(self.G):
-                self.G.add_edge(u, v)
-            matching = nx.bipartite.maximum_matching(self.G)
-            max_matching = int(len(matching) / 2)
-            if max_matching != perfect_matching:
-                self.G.add_edge(u, v)
+        if legacy:
+            while self.G.number_of_edges() > edges_num:
+                u, v = random.choice(list(self.G.edges()))
+                self.G.remove_edge(u, v)
+                if not nx.is_connected(self.G):
+                    self.G.add_edge(u, v)
+                matching = nx.bipartite.maximum_matching(self.G)
+                max_matching = int(len(matching) / 2)
+                if max_matching != perfect_matching:
+                    self.G.add_edge(u, v)
+        else:
+            prune_edges(self.G, edges_num, random, perfect_matching)
         for u, v in self.G.edges():
             self.G[u][v]['weight'] = random.randint(Min, Max)
         self.matching = nx.algorithms.matching.max_weight_matching(self.G, maxcardinality=False)
@@ -75,19 +82,10 @@ class QUBO:
 
 
     def generate(self) -> None:
-        self.qubo = {((i, j), (i, j)) : -w for i, j, w in self.bg.edges.data('weight')}
-        self.qubo_out = defaultdict(int)
         edges = list(self.bg.edges())
-        for i in range(self.edges_num):
-            for j in range(i+1, self.edges_num):
-                if conflict(edges[i], edges[j]):
-                    self.qubo[(edges[i], edges[j])] = self.penalty
-                else:
-                    self.qubo[(edges[i], edges[j])] = 0
-            
-        for key in self.qubo:
-            new_key = (self.index[key[0]], self.index[key[1]])
-            self.qubo_out[new_key] = self.qubo[key]
+        weights = [w for _, _, w in self.bg.edges.data('weight')]
+        # ビットの番号はself.indexと同じく辺のリストでの位置とする
+        self.qubo_out = matching_qubo(np.array(edges).reshape(-1, 2), weights, self.penalty)
 
     def print(self) -> None:
         jsonQUBO = {}
@@ -97,12 +95,8 @@ class QUBO:
         jsonQUBO['number of maximum matching'] = self.max_matching
         jsonQUBO['total weight'] = self.weight
         jsonQUBO['base'] = 0
-        jsonQUBO['qubo'] = [
-            [key[0], key[1], val] for key, val in sorted(self.qubo_out.items())]
-        jsonString = re.sub('[\r\n]\s+(-{0,1}\d+)\s*',
-                            '\\1', json.dumps(jsonQUBO, sort_keys=False, indent=4))
-        with open(rf'{self.nodes_num}-{self.edges_num}-bgmw.json','w') as obj:
-            obj.write(jsonString)
+        jsonQUBO['qubo'] = self.qubo_out
+        write_json(jsonQUBO, rf'{self.nodes_num}-{self.edges_num}-bgmw.json')
 
 
 def main():
@@ -115,9 +109,16 @@ def main():
     parser.add_argument('-Min', '--Min_weight', type=int, help='Minimum value of weights')
     parser.add_argument('-Max', '--Max_weight', type=int, help='Maximum value of weights')
     parser.add_argument('-P', '--penalty', type=int, help='Penalty of QUBO')
+    parser.add_argument('--legacy', action='store_true',
+                        help='check connectivity and matching from scratch after every removal (same graph, slower)')
     args = parser.parse_args()
     seed = 0
-    bigraph = Bigraph(args.Group1, args.Group2, args.Pos, args.Edges, args.Min_weight, args.Max_weight, seed)
+    try:
+        bigraph = Bigraph(args.Group1, args.Group2, args.Pos, args.Edges, args.Min_weight, args.Max_weight, seed,
+                          args.legacy)
+    except ValueError as e:
+        print(f'Error: {e}', file=sys.stderr)
+        sys.exit(1)
     qubo = QUBO(bigraph, args.penalty)
     qubo.generate()
     qubo.print()
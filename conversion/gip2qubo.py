@@ -1,11 +1,12 @@
-from collections import defaultdict
 import argparse
 import sys
-import json
-import re
 import random
 import time
-from typing import Tuple
+import os
+import numpy as np
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from common import RowBlocks, read_dimacs, write_json
 
 
 def rand_select(nbit: int, s=-1):
@@ -20,27 +21,9 @@ def rand_select(nbit: int, s=-1):
 class GIP:
 
     def __init__(self, filename: str) -> None:
-        with open(filename, "rt") as f:
-            lines = f.read()
-        vertices = lines.split('number of vertices  : ')
-        end = vertices[1].index('\n')
-        self.vertices_num = int(vertices[1][0:end])
-        self.G1 = []
-        edge_pair = []
-        all = lines.split('\ne ')
-        for i in range(len(all) - 1):
-            edge = []
-            edge_str = all[i + 1].split()
-            edge.append(int(edge_str[0]))
-            edge.append(int(edge_str[1]))
-            if edge[0] > edge[1]:
-                edge[0], edge[1] = edge[1], edge[0]
-            edge = tuple(edge)
-            edge_pair.append(edge)
-        edge_pair.sort(key=lambda edge_pair:edge_pair[0])
-        self.edge_num = len(edge_pair)
-        for j in range(len(edge_pair)):
-            self.G1.append(edge_pair[j])
+        self.vertices_num, edges = read_dimacs(filename)
+        self.edge_num = len(edges)
+        self.G1 = [tuple(edge) for edge in edges.tolist()]
         self.G2_gen()
 
 
@@ -67,67 +50,46 @@ class QUBO:
 
 
     def __init__(self, gip):
-        self.qubo = defaultdict(int)
         self.vertices_num = gip.vertices_num
         self.edge_num = gip.edge_num
-        self.G1 = {x:0 for x in gip.G1}
-        self.G2 = {x:0 for x in gip.G2}
         self.mapping = gip.mapping
+        self.A1 = QUBO.adjacency(gip.G1, self.vertices_num)
+        self.A2 = QUBO.adjacency(gip.G2, self.vertices_num)
 
     @staticmethod
-    def conflict(x: Tuple[int, int], y: Tuple[int, int], G1, G2) -> bool:
-
-        if x[0] > y[0]:
-            G1_edge = (y[0],x[0])
-        else:
-            G1_edge = (x[0],y[0])
-        if x[1] > y[1]:
-            G2_edge = (y[1],x[1])
-        else:
-            G2_edge = (x[1],y[1])
-
-        #if x[0] == y[0]:
-            #return True
-        #if x[1] == y[1]:
-            #return True
-        #if G1_edge in G1 and G2_edge not in G2:
-            #return True
-        #if G2_edge in G2 and G1_edge not in G1:
-            #return True
-        #return False
-
-        G1_judge = G1_edge in G1
-        G2_judge = G2_edge in G2
-
-        if x[0] != y[0] and x[1] != y[1]:
-            if G1_judge and G2_judge:
-                return False
-            elif not G1_judge and not G2_judge:
-                return False
-            else:
-                return True
-        return True
+    def adjacency(edges, n: int):
+        """1始まりの辺のリストから(n, n)のbool隣接行列を作る．"""
+        A = np.zeros((n, n), dtype=bool)
+        if len(edges) > 0:
+            e = np.asarray(edges, dtype=np.int64) - 1
+            A[e[:, 0], e[:, 1]] = True
+            A[e[:, 1], e[:, 0]] = True
+        return A
+
+    def block(self, i: int):
+        """x = (i+1, j+1) (j = 0, ..., n-1) を行とする要素を[index(x), index(y), v]の配列で返す．
+
+        index((a, b)) = (a - 1) n + bを1始まりのビットの番号とし，y = (k+1, l+1)に対し，
+        index(x) <= index(y)の範囲で，x == yなら-1，i == kまたはj == lなら1，
+        それ以外は辺(i, k)と辺(j, l)の一方だけが存在するなら1とする．
+        """
+        n = self.vertices_num
+        conflict = self.A1[i][None, :, None] ^ self.A2[:, None, :]
+        conflict |= (np.arange(n) == i)[None, :, None]
+        conflict |= np.eye(n, dtype=bool)[:, None, :]
+        u = i * n + np.arange(n)
+        v = np.arange(n * n).reshape(n, n)
+        conflict &= v >= u[:, None, None]
+        j, k, l = np.nonzero(conflict)
+        x = u[j]
+        y = k * n + l
+        return np.stack((x + 1, y + 1, np.where(x == y, -1, 1)), axis=1)
 
+    def generate(self) -> None:
+        self.qubo = RowBlocks(lambda: (self.block(i) for i in range(self.vertices_num)))
 
 
-    def generate(self) -> None:
-        for i in range(self.vertices_num):
-            for j in range(self.vertices_num):
-                for k in range(self.vertices_num):
-                    for l in range(self.vertices_num):
-                            x = (i+1, j+1)
-                            y = (k+1, l+1)
-                            if self.index(x)<=self.index(y):
-                                if x == y:
-                                    self.qubo[(x, y)] = -1
-                                elif QUBO.conflict(x, y, self.G1, self.G2):
-                                    self.qubo[(x, y)] = 1
-
-    def index(self, key: Tuple[int, int]) -> int:
-        return (key[0]-1)*self.vertices_num+(key[1]-1)+1
-
-
-    def write(self) -> None:
+    def write(self, compress: bool = False) -> None:
         jsonQUBO = {}
         jsonQUBO['problem'] = 'GIP'
         jsonQUBO['vertices'] = self.vertices_num
@@ -135,11 +97,8 @@ class QUBO:
         jsonQUBO['nbit'] = self.vertices_num*self.vertices_num
         jsonQUBO['mapping'] = self.mapping
         jsonQUBO['base'] = 1
-        jsonQUBO['qubo'] = [[self.index(key[0]), self.index(key[1]), val] for key, val in sorted(self.qubo.items())]
-        jsonString = re.sub('[\r\n]\s+(-{0,1}\d+)\s*','\\1', json.dumps(jsonQUBO, sort_keys=False, indent=4))
-        #print(jsonString)
-        with open(rf'v{self.vertices_num}-e{self.edge_num}-gip.json', 'w') as obj:
-            obj.write(jsonString)
+        jsonQUBO['qubo'] = self.qubo
+        write_json(jsonQUBO, rf'v{self.vertices_num}-e{self.edge_num}-gip.json' + ('.gz' if compress else ''))
 
 
 def main():
@@ -148,6 +107,10 @@ def main():
     parser = argparse.ArgumentParser(
         description='Convert GIP into QUBO problem instances')
     parser.add_argument('GIP', help='GIP File')
+    parser.add_argument('-z', '--gzip', action='store_true',
+                        help='write gzip compressed output (.json.gz). the row blocks are streamed into one '
+                             'gzip stream rather than compressed as separate blocks, so the file compresses better '
+                             'and is read like any other .json.gz')
 
 
     args = parser.parse_args()
@@ -155,7 +118,7 @@ def main():
     
     problem = QUBO(gip)
     problem.generate()
-    problem.write()
+    problem.write(args.gzip)
     toc = time.perf_counter()
     print(f"该程序耗时: {toc - tic:0.4f} seconds")
 
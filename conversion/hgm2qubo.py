@@ -1,10 +1,14 @@
 from collections import defaultdict
 import argparse
 from typing import Tuple
-import re
-import json
 import networkx as nx
 import random
+import sys
+import os
+import numpy as np
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from common import prune_edges, segment_pairs, write_json
 
 def sort_pair(x: int, y: int):
     if x <= y:
@@ -22,14 +26,17 @@ def conflict(match0, match1):
 
 
 class Hyper_Graph:
-    def __init__(self, m, n, p, edges_num, seed):
+    def __init__(self, m, n, p, edges_num, seed, legacy=False):
         random.seed(seed)
         self.G = nx.bipartite.random_graph(m, n, p)
-        while self.G.number_of_edges() > edges_num:
-            u, v = random.choice(list(self.G.edges()))
-            self.G.remove_edge(u, v)
-            if not nx.is_connected(self.G):
-                self.G.add_edge(u, v)
+        if legacy:
+            while self.G.number_of_edges() > edges_num:
+                u, v = random.choice(list(self.G.edges()))
+                self.G.remove_edge(u, v)
+                if not nx.is_connected(self.G):
+                    self.G.add_edge(u, v)
+        else:
+            prune_edges(self.G, edges_num, random)
 
 class QUBO:
 
@@ -50,21 +57,30 @@ class QUBO:
 
 
     def generate(self) -> None:
-        self.qubo = {(i, i) : -1 for i in self.sets[1]}
-        self.qubo_out = defaultdict(int)
-        edges = list(self.hg.edges())
-        record = []
-        for i in self.sets[0]:
-            edges = list(self.hg.edges(i))
-            for j in range(len(edges)):
-                for k in range(j+1, len(edges)):
-                    if sort_pair(edges[j][1], edges[k][1]) not in record:
-                        self.qubo[sort_pair(edges[j][1], edges[k][1])] = self.penalty
-                        record.append(sort_pair(edges[j][1], edges[k][1]))
+        """対角に-1，同じ頂点に接続する2つのハイパーエッジ (sets[1]の頂点) の組にpenaltyを置く．
 
-        for key in self.qubo:
-            new_key = (self.index[key[0]], self.index[key[1]])
-            self.qubo_out[new_key] = self.qubo[key]
+        組は頂点ごとの隣接頂点の組み合わせとして作り，ラベルの小さい方を先にした組を
+        int64のキーにまとめて重複を除く．要素は(index[小さいラベル], index[大きいラベル])とする．
+        """
+        set0 = list(self.sets[0])
+        set1 = list(self.sets[1])
+        index = np.zeros(max(self.hg.nodes(), default=-1) + 1, dtype=np.int64)
+        index[set1] = np.arange(self.size)
+        degree = [len(self.hg.adj[i]) for i in set0]
+        indptr = np.zeros(len(set0) + 1, dtype=np.int64)
+        np.cumsum(degree, out=indptr[1:])
+        nbrs = np.fromiter((j for i in set0 for j in self.hg.adj[i]), dtype=np.int64, count=indptr[-1])
+        a, b = segment_pairs(indptr, nbrs)
+        a, b = np.minimum(a, b), np.maximum(a, b)
+        n = len(index)
+        key = np.unique(a * n + b)
+        x = index[key // n]
+        y = index[key % n]
+        row = np.concatenate((np.arange(self.size), x))
+        col = np.concatenate((np.arange(self.size), y))
+        val = np.concatenate((np.full(self.size, -1), np.full(len(key), self.penalty)))
+        order = np.lexsort((col, row))
+        self.qubo_out = np.stack((row[order], col[order], val[order]), axis=1)
 
     def print(self) -> None:
         jsonQUBO = {}
@@ -72,12 +88,8 @@ class QUBO:
         jsonQUBO['nbit'] = self.size
         jsonQUBO['base'] = 0
         jsonQUBO['edges'] = list(self.hg.edges())
-        jsonQUBO['qubo'] = [
-            [key[0], key[1], val] for key, val in sorted(self.qubo_out.items())]
-        jsonString = re.sub('[\r\n]\s+(-{0,1}\d+)\s*',
-                            '\\1', json.dumps(jsonQUBO, sort_keys=False, indent=4))
-        with open(rf'{self.size}-hgm.json','w') as obj:
-            obj.write(jsonString)
+        jsonQUBO['qubo'] = self.qubo_out
+        write_json(jsonQUBO, rf'{self.size}-hgm.json')
 
 
 def main():
@@ -88,9 +100,15 @@ def main():
     parser.add_argument('-Po', '--Pos', type=float, help='possibility of edge generation')
     parser.add_argument('-e', '--Edges', type=int, help='number of edges')
     parser.add_argument('-Pe', '--Penalty', type=int, default=100, help='Penalty value')
+    parser.add_argument('--legacy', action='store_true',
+                        help='check connectivity from scratch after every removal (same graph, slower)')
     args = parser.parse_args()
     seed = 0
-    hypergraph = Hyper_Graph(args.Group1, args.Group2, args.Pos, args.Edges, seed)
+    try:
+        hypergraph = Hyper_Graph(args.Group1, args.Group2, args.Pos, args.Edges, seed, args.legacy)
+    except ValueError as e:
+        print(f'Error: {e}', file=sys.stderr)
+        sys.exit(1)
     qubo = QUBO(hypergraph, args.Penalty)
     qubo.generate()
     qubo.print()
@@ -1,8 +1,14 @@
 import random
-import json
-import re
 import time
 import argparse
+import sys
+import os
+import numpy as np
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from common import RowBlocks, read_dimacs, write_json
+
+_BLOCK = 1 << 22  # 1ブロックで扱う(行, 列)の組の数
 
 
 
@@ -10,43 +16,34 @@ import argparse
 class MCP:
 
     def __init__(self, filename: str, penalty) -> None:
-        with open(filename, "rt") as f:
-            lines = f.read()
-        vertices = lines.split('number of vertices  : ')
-        end = vertices[1].index('\n')
-        self.vertices_num = int(vertices[1][0:end])
-        self.G1 = []
-        edge_pair = []
-        all = lines.split('\ne ')
-        for i in range(len(all) - 1):
-            edge = []
-            edge_str = all[i + 1].split()
-            edge.append(int(edge_str[0]))
-            edge.append(int(edge_str[1]))
-            if edge[0] > edge[1]:
-                edge[0], edge[1] = edge[1], edge[0]
-            edge_pair.append(edge)
-        edge_pair.sort(key=lambda edge_pair:edge_pair[0])
-        self.edge_num = len(edge_pair)
-        for j in range(len(edge_pair)):
-            self.G1.append(edge_pair[j])
+        self.vertices_num, self.edges = read_dimacs(filename)
+        self.edge_num = len(self.edges)
+        self.G1 = self.edges.tolist()
         #print(self.G1)
         self.MCP_gen(penalty)
 
     def MCP_gen(self, penalty):
-        self.MCP = []
-        for i in range(self.vertices_num):
-            for j in range(self.vertices_num):
-                if i <= j:
-                    if i == j:
-                        self.MCP.append([i, j, -1])
-                    else:
-                        self.MCP.append([i, j, penalty])
-
-        for i in range(self.edge_num):
-            MIS_edge = [self.G1[i][0] - 1, self.G1[i][1] - 1]
-            MIS_edge.append(penalty)
-            self.MCP.remove(MIS_edge)
+        """補グラフの辺 (i < j) にpenalty，対角に-1を置くQUBOを，行ごとに並べた要素の列として作る．
+
+        出力は行優先 (i, jの昇順) で，行のブロックごとに辺のビットマップから生成する．
+        """
+        self.penalty = penalty
+        self.MCP = RowBlocks(self.blocks)
+
+    def blocks(self, block_size: int = _BLOCK):
+        n = self.vertices_num
+        u = self.edges[:, 0] - 1
+        v = self.edges[:, 1] - 1
+        step = max(1, block_size // max(1, n))
+        for start in range(0, n, step):
+            rows = np.arange(start, min(start + step, n))
+            keep = np.arange(n)[None, :] >= rows[:, None]
+            lo, hi = np.searchsorted(u, [start, rows[-1] + 1])
+            off = u[lo:hi] != v[lo:hi]
+            keep[u[lo:hi][off] - start, v[lo:hi][off]] = False
+            i, j = np.nonzero(keep)
+            i += start
+            yield np.stack((i, j, np.where(i == j, -1, self.penalty)), axis=1)
 
     def write(self) -> None:
         jsonQUBO = {}
@@ -56,10 +53,7 @@ class MCP:
         jsonQUBO['nbit'] = self.vertices_num
         jsonQUBO['base'] = 0
         jsonQUBO['qubo'] = self.MCP
-        jsonString = re.sub('[\r\n]\s+(-{0,1}\d+)\s*','\\1', json.dumps(jsonQUBO, sort_keys=False, indent=4))
-        #print(jsonString)
-        with open(rf'{self.vertices_num}-MCP.json', 'w') as obj:
-            obj.write(jsonString)
+        write_json(jsonQUBO, rf'{self.vertices_num}-MCP.json')
 
 def main():
     tic = time.perf_counter()
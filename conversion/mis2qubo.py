@@ -1,63 +1,74 @@
 import random
-import json
-import re
-import networkx as nx
 import argparse
-from collections import defaultdict
+import sys
+import os
+import numpy as np
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from common import RowBlocks, write_json
+
+_BLOCK = 1 << 22  # 1ブロックで扱う(行, 列)の組の数
 
 
 
 class MIS:
 
     def __init__(self, nodes, mis_num, seed) -> None:
+        """最大独立集合misを埋め込んだグラフ．mis内の2頂点の組以外はすべて辺で結ぶ．
+
+        辺は明示的に持たず，mis内の頂点を表すビットマップin_misで表す．
+        """
         random.seed(seed)
         self.nodes = nodes
         self.mis_num = mis_num
-        self.G = nx.Graph()
-        self.G.add_nodes_from(range(self.nodes))
         self.mis = set(random.sample(range(self.nodes), self.mis_num))
-        for i in range(self.nodes):
-            for j in range(self.nodes):
-                if i < j:
-                    if i not in self.mis and j in self.mis:
-                        self.G.add_edge(i, j)
-                    elif i in self.mis and j not in self.mis:
-                        self.G.add_edge(i, j)
-                    elif i not in self.mis and j not in self.mis:
-                        self.G.add_edge(i, j)
+        self.in_mis = np.zeros(self.nodes, dtype=bool)
+        self.in_mis[list(self.mis)] = True
+        self.edge_num = nodes * (nodes - 1) // 2 - mis_num * (mis_num - 1) // 2
 
 class QUBO:
 
-    def __init__(self, MIS, penalty) -> None:
-        self.G = MIS.G
+    def __init__(self, MIS, penalty, omit_zeros: bool = False) -> None:
+        self.in_mis = MIS.in_mis
+        self.edge_num = MIS.edge_num
         self.mis_num = MIS.mis_num
         self.penalty = penalty
-        self.size = len(self.G.nodes())
-    
+        self.omit_zeros = omit_zeros
+        self.size = MIS.nodes
+
+    def blocks(self, block_size: int = _BLOCK):
+        """行のブロックごとに上三角の要素[i, j, v]を返す．
+
+        対角は-1，辺 (mis内の2頂点の組以外) はpenalty，辺でない組は0 (omit_zerosなら出力しない) とする．
+        """
+        n = self.size
+        step = max(1, block_size // max(1, n))
+        for start in range(0, n, step):
+            rows = np.arange(start, min(start + step, n))
+            keep = np.arange(n)[None, :] >= rows[:, None]
+            i, j = np.nonzero(keep)
+            i += start
+            val = np.where(self.in_mis[i] & self.in_mis[j], 0, self.penalty)
+            val[i == j] = -1
+            if self.omit_zeros:
+                nz = val != 0
+                i, j, val = i[nz], j[nz], val[nz]
+            yield np.stack((i, j, val), axis=1)
+
     def generate(self):
-        self.qubo=defaultdict(int)
-        for i in range(self.size):
-            self.qubo[(i, i)] = -1
-            for j in range(i + 1, self.size):
-                if (i, j) in self.G.edges():
-                    self.qubo[(i, j)] = self.penalty
-                else:
-                    self.qubo[(i, j)] = 0
+        self.qubo = RowBlocks(self.blocks)
 
 
     def write(self) -> None:
         jsonQUBO = {}
         jsonQUBO['problem'] = 'MIS'
         jsonQUBO['nodes'] = self.size
-        jsonQUBO['edges'] = len(self.G.edges())
+        jsonQUBO['edges'] = self.edge_num
         jsonQUBO['MIS'] = self.mis_num
         jsonQUBO['nbit'] = self.size
         jsonQUBO['base'] = 0
-        jsonQUBO['qubo'] = [[key[0], key[1], val] for key, val in sorted(self.qubo.items())]
-        jsonString = re.sub('[\r\n]\s+(-{0,1}\d+)\s*','\\1', json.dumps(jsonQUBO, sort_keys=False, indent=4))
-        #print(jsonString)
-        with open(rf'{self.size}-MIS.json', 'w') as obj:
-            obj.write(jsonString)
+        jsonQUBO['qubo'] = self.qubo
+        write_json(jsonQUBO, rf'{self.size}-MIS.json')
 
 def main():
     parser = argparse.ArgumentParser(
@@ -65,6 +76,7 @@ def main():
     parser.add_argument('-n', '--Nodes', type=int, help='nodes number')
     parser.add_argument('-m', '--Mis', type=int, help='MIS')
     parser.add_argument('-P', '--Penalty', type=int, default=100, help='Penalty value')
+    parser.add_argument('--omit-zeros', action='store_true', help='do not write zero terms for non-edges')
 
     args = parser.parse_args()
     nodes = args.Nodes
@@ -73,7 +85,7 @@ def main():
     seed = 0
 
     problem = MIS(nodes, mis, seed)
-    qubo = QUBO(problem, penalty)
+    qubo = QUBO(problem, penalty, args.omit_zeros)
     qubo.generate()
     qubo.write()
 
@@ -1,9 +1,13 @@
 from collections import defaultdict
 import argparse
-import re
-import json
 import networkx as nx
 import random
+import sys
+import os
+import numpy as np
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from common import matching_qubo, write_json
 
 
 def sort_pair(x: int, y: int):
@@ -55,17 +59,10 @@ class QUBO:
             k = k + 1
 
     def generate(self) -> None:
-        self.qubo = {((i, j), (i, j)): -w for i, j, w in self.G.edges.data('weight')}
-        self.qubo_out = defaultdict(int)
         edges = list(self.G.edges())
-        for i in range(self.edges_num):
-            for j in range(i + 1, self.edges_num):
-                if conflict(edges[i], edges[j]):
-                    self.qubo[(edges[i], edges[j])] = self.penalty
-
-        for key in self.qubo:
-            new_key = (self.index[key[0]], self.index[key[1]])
-            self.qubo_out[new_key] = self.qubo[key]
+        weights = [w for _, _, w in self.G.edges.data('weight')]
+        # ビットの番号はself.indexと同じく辺のリストでの位置とする
+        self.qubo_out = matching_qubo(np.array(edges).reshape(-1, 2), weights, self.penalty)
 
     def print(self) -> None:
         jsonQUBO = {}
@@ -77,12 +74,9 @@ class QUBO:
         jsonQUBO['number of maximum matching'] = self.max_matching
         jsonQUBO['total weight'] = self.weight
         jsonQUBO['base'] = 0
-        jsonQUBO['qubo'] = [[key[0], key[1], val] for key, val in sorted(self.qubo_out.items()) if val != 0]
+        jsonQUBO['qubo'] = self.qubo_out
 
-        jsonString = re.sub('[\r\n]\s+(-{0,1}\d+)\s*',
-                            '\\1', json.dumps(jsonQUBO, sort_keys=False, indent=4))
-        with open(rf'{self.nodes_num}-{self.edges_num}-mwm.json', 'w') as obj:
-            obj.write(jsonString)
+        write_json(jsonQUBO, rf'{self.nodes_num}-{self.edges_num}-mwm.json')
 
 
 def main():
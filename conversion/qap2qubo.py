@@ -1,67 +1,62 @@
-from collections import defaultdict
 import argparse
 import sys
-import json
-import re
+import os
+import numpy as np
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from common import RowBlocks, read_qap, write_json
 
 
 class QAP:
 
     def __init__(self, filename: str) -> None:
-        with open(filename, "rt") as f:
-            lines = f.read()
-            all = [int(x) for x in lines.split()]
-            self.nsite = all[0]
-            self.nbit = self.nsite*self.nsite
-            self.A = []
-            self.B = []
-            for i in range(1, self.nbit, self.nsite):
-                self.A.append(all[i:i+self.nsite])
-                self.B.append(all[i+self.nbit:i+self.nsite+self.nbit])
+        self.nsite, self.A, self.B = read_qap(filename)
+        self.nbit = self.nsite*self.nsite
 
 
 class QUBO:
 
     def __init__(self, qap, penalty: int) -> None:
-        self.qubo = defaultdict(int)
         self.nsite = qap.nsite
         self.nbit = qap.nbit
-        self.maxval = 0
-        for i in range(qap.nsite):
-            for j in range(qap.nsite):
-                for k in range(qap.nsite):
-                    for l in range(qap.nsite):
-                        # 場所iに工場jに置き，場所kに工場lに置く．A[i][j]:場所iと場所jの距離，B[k][l]工場kと工場lの物流量
-                        val = qap.A[i][k] * qap.B[j][l] + \
-                            qap.A[k][i] * qap.B[l][j]
-                        if val!=0:
-                            self.qubo[(i, j, k, l)] = val
-                            if val > self.maxval:
-                                self.maxval = val
-        for i in range(qap.nsite):
-            for j in range(qap.nsite):
-                for k in range(qap.nsite):
-                    for l in range(qap.nsite):
-                        if i == k:
-                            if j == l:
-                                self.qubo[(i, j, k, l)] -= penalty #場所i==kに工場j==lを置くのは矛盾しない
-                            else:
-                                self.qubo[(i, j, k, l)] += penalty #場所i==kに工場j!=lを置くのは矛盾する．
-                                self.qubo[(j, i, l, k)] += penalty #場所j!=lに工場i==lを置くのは矛盾する．
-
-    def write(self) -> None:
+        self.A = np.array(qap.A, dtype=np.int64).reshape(self.nsite, self.nsite)
+        self.B = np.array(qap.B, dtype=np.int64).reshape(self.nsite, self.nsite)
+        self.penalty = penalty
+        self.maxval = max([0] + [int(self.objective(i).max()) for i in range(self.nsite)])
+
+    def objective(self, i: int):
+        """場所iに工場jを置き，場所kに工場lを置くときの目的関数の係数を(j, k, l)の配列で返す．
+
+        A[i][k]:場所iと場所kの距離，B[j][l]:工場jと工場lの物流量として A[i][k] B[j][l] + A[k][i] B[l][j]
+        """
+        return self.A[i][None, :, None] * self.B[:, None, :] + self.A[:, i][None, :, None] * self.B.T[:, None, :]
+
+    def block(self, i: int):
+        """ビットi*nsite+j (j = 0, ..., nsite-1) を行とする上三角の要素を[x, y, v]の配列で返す．
+
+        同じ場所 (i == k) または同じ工場 (j == l) の2ビットには，片方だけ一致するならpenaltyを足し (矛盾する)，
+        両方一致する (対角) ならpenaltyを引く．目的関数の係数が0でも，このどちらかに当たる要素は出力する．
+        """
+        n = self.nsite
+        val = self.objective(i)
+        present = val != 0
+        same_site = (np.arange(n) == i)[None, :, None]
+        same_factory = np.eye(n, dtype=bool)[:, None, :]
+        val += self.penalty * (same_site ^ same_factory) - self.penalty * (same_site & same_factory)
+        present |= same_site | same_factory
+        # 上三角 (k*n + l >= i*n + j) だけを残す
+        present &= (np.arange(n * n).reshape(n, n) >= i * n + np.arange(n)[:, None, None])
+        j, k, l = np.nonzero(present)
+        return np.stack((i * n + j, k * n + l, val[j, k, l]), axis=1)
+
+    def write(self, fname: str) -> None:
         jsonQUBO = {}
         jsonQUBO['problem'] = 'QAP'
         jsonQUBO['nbit'] = self.nbit
         jsonQUBO['base'] = 0
         jsonQUBO['maxval'] = self.maxval
-        jsonQUBO['qubo'] = [[index[0]*self.nsite+index[1], index[2]*self.nsite + index[3], val] for index,
-                            val in sorted(self.qubo.items()) if index[0]*self.nsite+index[1] <= index[2]*self.nsite + index[3]]
-        jsonString = re.sub('[\r\n]\s+(-{0,1}\d+)\s*',
-                            '\\1', json.dumps(jsonQUBO, sort_keys=False, indent=4))
-        #print(jsonString)
-        with open(r'/home/xiaotian/QUBO_json/qap.json','w') as obj:
-            obj.write(jsonString)
+        jsonQUBO['qubo'] = RowBlocks(self.block(i) for i in range(self.nsite))
+        write_json(jsonQUBO, fname)
 
 
 def main():
@@ -70,10 +65,12 @@ def main():
     parser.add_argument('QAP', help='QAP File')
     parser.add_argument('-p', '--penalty', type=int,
                         required=True, help='Penalty value')
+    parser.add_argument('-o', '--output', default='qap.json',
+                        help='QUBO file to be output (gzip compressed if it ends with .gz)')
     args = parser.parse_args()
     qap = QAP(args.QAP)
     problem = QUBO(qap, args.penalty)
-    problem.write()
+    problem.write(args.output)
 
 
 if __name__ == "__main__":
@@ -1,29 +1,59 @@
 import networkx as nx
 import numpy as np
-import json
-import re
 from collections import defaultdict
-from pyqubo import Array, Placeholder, Constraint
 import argparse
 from itertools import product
 import random
+import json
+import sys
+import os
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from common import QUBOMatrix, write_json
 
 
 def dist_gen(n, size):
+    """1以上size以下のランダムな重みの完全グラフの最短路距離を返す．
+
+    重みはi < jの順にrandom.randintで生成する．
+    """
     dist_matrix = np.zeros((n, n))
-    for i in range(n):
-        for j in range(i+1, n):
-            d = random.randint(1, size)
-            dist_matrix[i][j] = d
-            dist_matrix[j][i] = d
-    for i in range(n):
-        for j in range(n):
-            for k in range(n):
-                if dist_matrix[i][j] + dist_matrix[j][k] < dist_matrix[i][k]:
-                    dist_matrix[i][k] = dist_matrix[i][j] + dist_matrix[j][k]
+    i, j = np.triu_indices(n, 1)
+    d = [random.randint(1, size) for _ in range(len(i))]
+    dist_matrix[i, j] = d
+    dist_matrix[j, i] = d
+    return metric_closure(dist_matrix)
+
+
+def metric_closure(dist_matrix):
+    """Floyd-Warshall法で全点対の最短路距離を求める．"""
+    dist_matrix = np.array(dist_matrix)
+    for k in range(len(dist_matrix)):
+        np.minimum(dist_matrix, dist_matrix[:, k, None] + dist_matrix[None, k, :], out=dist_matrix)
     return dist_matrix
 
 
+def check_metric(fname):
+    """*-info-tsp.jsonの距離行列が対称で対角が0，三角不等式を満たすかを確認する．
+
+    Returns:
+        問題点のリスト (空なら距離の公理を満たす)
+    """
+    with open(fname, 'rt') as f:
+        dist_matrix = np.array(json.load(f)['distance_matrix'])
+    errors = []
+    if not np.array_equal(dist_matrix, dist_matrix.T):
+        errors.append('distance matrix is not symmetric')
+    if np.any(np.diag(dist_matrix) != 0):
+        errors.append('diagonal is not zero')
+    closure = metric_closure(dist_matrix)
+    violations = np.argwhere(closure < dist_matrix)
+    if len(violations) > 0:
+        i, k = violations[0]
+        errors.append(f'{len(violations)} pairs violate the triangle inequality (e.g. d[{i}][{k}] = {dist_matrix[i, k]} > {closure[i, k]})')
+    return errors
+
+
 class TSP:
 
     def __init__(self, n, size):
@@ -35,19 +65,58 @@ class TSP:
         TSP_cities = {}
         TSP_cities['number of cities'] = self.n_cities
         TSP_cities['distance_matrix'] = self.dist_matrix.tolist()
-        cities_String = re.sub('[\r\n]\s+(-{0,1}\d+)\s*', '\\1', json.dumps(TSP_cities, sort_keys=False, indent=4))
-        with open(rf'{self.n_cities}-info-tsp.json', 'w') as obj:
-            obj.write(cities_String)
+        write_json(TSP_cities, rf'{self.n_cities}-info-tsp.json')
 
 
 
 class QUBO:
 
 
-    def __init__(self, tsp, penalty):
+    def __init__(self, tsp, penalty, backend='numpy'):
         p = tsp.n_cities
         self.n_cities = p
         self.dist_matrix = tsp.dist_matrix
+        if backend == 'pyqubo':
+            self.build_pyqubo(penalty)
+        else:
+            self.build(penalty)
+
+    def build(self, penalty):
+        """距離，時刻の制約，都市の制約の項をインデックス配列に直接書き込んでQUBOを作る．
+
+        x[k,i] (時刻kに都市i) をビットk*p+iとする．出力はpyquboでコンパイルした場合
+        (build_pyqubo) と同じで，重みが0の要素は除き，各要素の2つのビットはラベル'Q[k][i]'の
+        文字列として小さい方を先に置き，全体を整列する．
+        """
+        p = self.n_cities
+        n = p * p
+        var = np.arange(n).reshape(p, p)
+        d = np.asarray(self.dist_matrix).astype(np.int64)
+        # 距離: d_ij x[k,i] x[(k+1)%p,j]
+        K, I, J = np.meshgrid(np.arange(p), np.arange(p), np.arange(p), indexing='ij')
+        rows = [var[K, I].ravel()]
+        cols = [var[(K + 1) % p, J].ravel()]
+        vals = [d[I, J].ravel()]
+        # 制約: A (sum - 1)^2 は同じ時刻・同じ都市の2ビットに2A，各ビットに時刻と都市で-2A，定数A
+        a, b = np.triu_indices(p, 1)
+        rows += [var[:, a].ravel(), var[a, :].ravel(), np.arange(n)]
+        cols += [var[:, b].ravel(), var[b, :].ravel(), np.arange(n)]
+        vals += [np.full(2 * p * len(a), 2 * penalty), np.full(n, -2 * penalty)]
+        matrix = QUBOMatrix.from_coo(n, np.concatenate(rows), np.concatenate(cols), np.concatenate(vals)).eliminate_zeros()
+        self.offset = float(2 * p * penalty)
+
+        rank = np.empty(n, dtype=np.int64)
+        rank[sorted(range(n), key=lambda h: rf'Q[{h // p}][{h % p}]')] = np.arange(n)
+        swap = rank[matrix.row] > rank[matrix.col]
+        first = np.where(swap, matrix.col, matrix.row)
+        second = np.where(swap, matrix.row, matrix.col)
+        order = np.lexsort((second, first))
+        self.qubo = np.stack((first[order], second[order], matrix.val[order]), axis=1).astype(np.int64)
+
+    def build_pyqubo(self, penalty):
+        """pyquboで式をコンパイルしてQUBOを作る (buildの検証用)．"""
+        from pyqubo import Array, Placeholder, Constraint
+        p = self.n_cities
         x = Array.create('Q', (p, p), 'BINARY')
 
         time_cons = 0
@@ -69,7 +138,7 @@ class QUBO:
         feed_dict = {'A': penalty}
         self.qubo_tup, self.offset = model.to_qubo(feed_dict=feed_dict)
         self.qubo_dict = dict(self.qubo_tup)
-        self.qubo = []
+        qubo = []
         self.mapping = defaultdict()
         h = 0
         for i in range(p):
@@ -80,9 +149,10 @@ class QUBO:
         for key0, key1, in self.qubo_dict:
             val = int(self.qubo_dict[(key0, key1)])
             if key0 > key1:
-                self.qubo.append([self.mapping[key1], self.mapping[key0], val])
+                qubo.append([self.mapping[key1], self.mapping[key0], val])
             else:
-                self.qubo.append([self.mapping[key0], self.mapping[key1], val])
+                qubo.append([self.mapping[key0], self.mapping[key1], val])
+        self.qubo = sorted(qubo)
 
 
     def write_json(self):
@@ -92,10 +162,8 @@ class QUBO:
         jsonQUBO['nbit'] = self.n_cities * self.n_cities
         jsonQUBO['offset'] = self.offset
         jsonQUBO['base'] = 0
-        jsonQUBO['qubo'] = sorted(self.qubo)
-        jsonString = re.sub('[\r\n]\s+(-{0,1}\d+)\s*', '\\1', json.dumps(jsonQUBO, sort_keys=False, indent=4))
-        with open(rf'{self.n_cities}-cities-tsp.json', 'w') as obj:
-            obj.write(jsonString)
+        jsonQUBO['qubo'] = self.qubo
+        write_json(jsonQUBO, rf'{self.n_cities}-cities-tsp.json')
 
 
 def main():
@@ -106,15 +174,27 @@ def main():
     parser.add_argument('-n', '--n_cities', type=int, help='number of cities')
     parser.add_argument('-s', '--size', type=int, help='size of axis')
     parser.add_argument('-p', '--Penalty', type=int, help='Penalty value')
+    parser.add_argument('--backend', default='numpy', choices=['numpy', 'pyqubo'],
+                        help='build QUBO directly with NumPy or by compiling with pyqubo (for cross-checking)')
+    parser.add_argument('--check', metavar='INFO_JSON',
+                        help='check that the distance matrix of *-info-tsp.json is a metric, then exit')
 
     args = parser.parse_args()
+    if args.check is not None:
+        errors = check_metric(args.check)
+        for e in errors:
+            print(f'{args.check}: {e}')
+        if errors:
+            sys.exit(1)
+        print(f'{args.check}: OK')
+        return
     n = args.n_cities
     size = args.size
     penalty = args.Penalty
 
     tsp = TSP(n, size)   
     tsp.write_city()
-    model = QUBO(tsp, penalty)
+    model = QUBO(tsp, penalty, args.backend)
     model.write_json()
 
 if __name__ == "__main__":
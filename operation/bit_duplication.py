@@ -1,25 +1,20 @@
 import random
 import argparse
 import json
-import re
 import sys
-import gzip
-from collections import defaultdict
+import os
 import numpy as np
 
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from common import QUBOMatrix, load_qubo, write_json
+
+_SPLIT_ELEMENTS = 1 << 22  # random_splitsで一度に作る要素の数の上限
+
 
 def errorExit(s: str):
     print(s, file=sys.stderr)
     sys.exit(1)
 
-def rand_val(n, val):
-    abs_val = abs(val)
-    while True:
-        p = [random.randint(-abs_val, abs_val) for _ in range(n)]
-        if sum(p) == val:
-            break
-    return p
-
 def rand_select(nbit: int, s=-1):
     if s == -1:
         s = nbit
@@ -37,11 +32,177 @@ def randPerm(nbit: int):
         p[i], p[j] = p[j], p[i]
     return p
 
-def sort_pair(x: int, y: int):
-    if x <= y:
-        return x, y
+
+def random_splits(values, n: int, rng):
+    """各値vを，和がvで各要素が-|v|以上|v|以下のn個の整数にランダムに分ける．
+
+    その範囲から一様に選んだ分け方になるように，n-1個を一様に選んで最後の1個を差とし，
+    範囲に入らない行だけを選び直す．メモリを抑えるため，いくつかの行ずつに分けて処理する．
+
+    Args:
+        values: 分ける値の配列
+        n (int): 分ける数
+        rng: numpy.random.Generator
+
+    Returns:
+        (len(values), n)のint64配列
+    """
+    values = np.asarray(values, dtype=np.int64)
+    result = np.empty((len(values), n), dtype=np.int64)
+    if n == 1:
+        result[:, 0] = values
+        return result
+    step = max(1, _SPLIT_ELEMENTS // n)
+    for start in range(0, len(values), step):
+        todo = np.arange(start, min(start + step, len(values)))
+        while len(todo) > 0:
+            bound = np.abs(values[todo])[:, None]
+            head = rng.integers(-bound, bound, size=(len(todo), n - 1), endpoint=True)
+            last = values[todo] - head.sum(axis=1)
+            ok = np.abs(last) <= bound[:, 0]
+            result[todo[ok], :n - 1] = head[ok]
+            result[todo[ok], n - 1] = last[ok]
+            todo = todo[~ok]
+    return result
+
+
+def auto_penalty(matrix: QUBOMatrix, mapping):
+    """複製ごとに，複製を等しく保つのに必要なペナルティを計算する．
+
+    各ビットの対角要素と，隣接する要素の正の重みの和・負の重みの和 (CSRの行ごとの区間和) から，
+    隣り合う複製x, x'の一方を反転したときのエネルギーの変化の上下限dEを求め，
+    その絶対値の最大を複製のペナルティとする．
+
+    Args:
+        matrix (QUBOMatrix): 重みを分配した後の (ペナルティを加える前の) 行列
+        mapping: (複製したビットの数, 複製数)の複製の番号
+
+    Returns:
+        複製したビットごとのペナルティ (int64の配列)
+    """
+    indptr, _, data = matrix.adjacency()
+    pos = np.zeros(len(data) + 1, dtype=np.int64)
+    neg = np.zeros(len(data) + 1, dtype=np.int64)
+    np.cumsum(np.maximum(data, 0), out=pos[1:])
+    np.cumsum(np.minimum(data, 0), out=neg[1:])
+    pos = pos[indptr[1:]] - pos[indptr[:-1]]
+    neg = neg[indptr[1:]] - neg[indptr[:-1]]
+    d = matrix.diagonal()
+
+    left, right = mapping[:, :-1], mapping[:, 1:]
+    # 隣り合う複製の間の重み (負のときだけ使う)
+    key = matrix.row.astype(np.int64) * matrix.nbit + matrix.col
+    target = left * matrix.nbit + right
+    i = np.searchsorted(key, target)
+    found = i < len(key)
+    found[found] = key[i[found]] == target[found]
+    w = np.zeros(target.shape, dtype=np.int64)
+    w[found] = np.minimum(matrix.val[i[found]], 0)
+    dE = np.stack((-(d[left] + pos[left] + w), -(d[right] + pos[right] + w),
+                   d[left] + neg[left] - w, d[right] + neg[right] - w))
+    return np.abs(dE.min(axis=0)).max(axis=1, initial=0)
+
+
+def duplicate_bits(matrix: QUBOMatrix, dup_normal: int, duplicate_num: int, dup_normal2: int, duplicate_num2: int,
+                   penalty=None, rng=None):
+    """ランダムに選んだビットを複製し，重みを複製に分配したQUBO行列を返す．
+
+    dup_normal個のビットをそれぞれduplicate_num個に，dup_normal2個のビットをduplicate_num2個に複製する．
+    複製は元のビットの後ろ (nbit以降) に追加し，複製同士が等しくなるようにペナルティを加える．
+    非対角要素W_{x,y}はxの複製とyの複製のすべての組に，複製したビットの対角要素W_{x,x}は
+    xの複製の (自分自身を含む) すべての組に，random_splitsで分配する．
+
+    Args:
+        matrix (QUBOMatrix): 元の行列
+        dup_normal (int): duplicate_num個に複製するビットの数
+        duplicate_num (int): 1ビットあたりの複製数 (元のビットを含む)
+        dup_normal2 (int): duplicate_num2個に複製するビットの数
+        duplicate_num2 (int): 1ビットあたりの複製数 (元のビットを含む)
+        penalty (int): 複製を等しくするペナルティ (Noneなら自動で計算する)
+        rng: 重みの分配に使うnumpy.random.Generator (Noneならrandomモジュールから種を取る)
+
+    Returns:
+        複製後の行列 (QUBOMatrix) と，'normal duplicated'，'normal2 duplicated'，'penalty'，
+        'mapping normal'，'mapping normal2'からなる辞書
+    """
+    nbit = matrix.nbit
+
+    # bit duplication + bit duplication
+    p = list(rand_select(nbit, dup_normal + dup_normal2))
+    p.sort()
+    p_normal = p[0:dup_normal]
+    p_normal2 = p[dup_normal:dup_normal + dup_normal2]
+    if rng is None:
+        rng = np.random.default_rng(random.getrandbits(64))
+
+    # 各ビットの複製の数と，k番目 (k >= 1) の複製の番号 first[x] + k - 1
+    copies = np.ones(nbit, dtype=np.int64)
+    first = np.zeros(nbit, dtype=np.int64)
+    start = nbit
+    mappings = []
+    for bits, num in ((p_normal, duplicate_num), (p_normal2, duplicate_num2)):
+        bits = np.array(bits, dtype=np.int64)
+        copies[bits] = num
+        first[bits] = start + (num - 1) * np.arange(len(bits))
+        mapping = np.empty((len(bits), num), dtype=np.int64)
+        mapping[:, 0] = bits
+        mapping[:, 1:] = first[bits][:, None] + np.arange(num - 1)
+        mappings.append(mapping)
+        start += (num - 1) * len(bits)
+    nbit_new = start
+
+    def copy(x, k):
+        return np.where(k == 0, x, first[x] + k - 1)
+
+    m = matrix.eliminate_zeros()
+    rows, cols, vals = [np.zeros(0, dtype=np.int64)], [np.zeros(0, dtype=np.int64)], [np.zeros(0, dtype=np.int64)]
+    # 非対角要素: xの複製a番目とyの複製b番目 (k = a * copies[y] + b) に分ける
+    off = m.row != m.col
+    x, y, v = m.row[off].astype(np.int64), m.col[off].astype(np.int64), m.val[off]
+    count = copies[x] * copies[y]
+    for n in np.unique(count).tolist():
+        sel = count == n
+        k = np.arange(n)[None, :]
+        cy = copies[y[sel]][:, None]
+        rows.append(copy(x[sel][:, None], k // cy).ravel())
+        cols.append(copy(y[sel][:, None], k % cy).ravel())
+        vals.append(random_splits(v[sel], n, rng).ravel())
+    # 対角要素: 複製したビットはその複製の組 (a <= b) に分ける
+    diag = ~off
+    x, v = m.row[diag].astype(np.int64), m.val[diag]
+    for n in np.unique(copies[x]).tolist():
+        sel = copies[x] == n
+        a, b = np.triu_indices(n)
+        rows.append(copy(x[sel][:, None], a[None, :]).ravel())
+        cols.append(copy(x[sel][:, None], b[None, :]).ravel())
+        vals.append(random_splits(v[sel], len(a), rng).ravel())
+
+    # 制約式を追加
+    if penalty is not None:
+        #ペナルティを設定
+        penalties = [np.full(len(mapping), penalty, dtype=np.int64) for mapping in mappings]
+    else:
+        #ペナルティを自動的に計算
+        split = QUBOMatrix.from_coo(nbit_new, np.concatenate(rows), np.concatenate(cols), np.concatenate(vals))
+        penalties = [auto_penalty(split, mapping) for mapping in mappings]
+    # 隣り合う複製ごとに P x_j + P x_{j+1} - 2P x_j x_{j+1}
+    for mapping, P in zip(mappings, penalties):
+        left, right = mapping[:, :-1].ravel(), mapping[:, 1:].ravel()
+        P = np.repeat(P, mapping.shape[1] - 1)
+        rows += [left, right, left]
+        cols += [left, right, right]
+        vals += [P, P, -2 * P]
+    duplicated = QUBOMatrix.from_coo(nbit_new, np.concatenate(rows), np.concatenate(cols), np.concatenate(vals))
+
+    record = {'normal duplicated': p_normal, 'normal2 duplicated': p_normal2}
+    if penalty is not None:
+        record['penalty'] = penalty
     else:
-        return y, x
+        record['penalty'] = penalties[0].tolist()
+        record['penalty2'] = penalties[1].tolist()
+    record['mapping normal'] = mappings[0].tolist()
+    record['mapping normal2'] = mappings[1].tolist()
+    return duplicated.eliminate_zeros(), record
 
 
 def main():
@@ -49,7 +210,7 @@ def main():
     parser = argparse.ArgumentParser(
         description='Bit duplication for generating hard QUBO problem')
     parser.add_argument(
-        '-Q', '--QUBOfile', type=str, help='QUBO problem file. must be .json/.json.gz. stdin if omitted')
+        '-Q', '--QUBOfile', type=str, help='QUBO problem file. must be .json/.json.gz/.qbin. stdin if omitted')
     parser.add_argument('-P', '--Penalty', type=int, help='Penalty value')
 
     parser.add_argument('-r1', '--ratio', type=str,
@@ -71,291 +232,57 @@ def main():
     duplicate_num2 = args.duplicate_num2
     solfile = args.solutionfile
     QUBOfile = args.QUBOfile
-    
-    with open(QUBOfile, "rt") as f:
-        problem = json.load(f)
 
     if args.ratio.isdecimal():
         dup_normal = int(args.ratio)
     else:
         dup_normal = float(args.ratio)
     
-    if args.ratio2 is not None:
-        if args.ratio2.isdecimal():
-            dup_normal2 = int(args.ratio2)
-        else:
-            dup_normal2 = float(args.ratio2)
+    if args.ratio2 is None:
+        dup_normal2 = 0
+        duplicate_num2 = 1
+    elif args.ratio2.isdecimal():
+        dup_normal2 = int(args.ratio2)
+    else:
+        dup_normal2 = float(args.ratio2)
         
     
-    if QUBOfile is None:
-        qubofile = sys.stdin
-    elif re.search('.json.gz$', args.QUBOfile, flags=re.IGNORECASE) is not None:
-        qubofile = gzip.open(args.QUBOfile, 'rt')
-    elif re.search('.json$', args.QUBOfile, flags=re.IGNORECASE) is not None:
-        qubofile = open(args.QUBOfile, 'rt')
-    else:
-        errorExit(f'QUBO Problem file must be .json or .json.gz')
-
-    problem = json.load(qubofile)
-
-    nbit = problem.get('nbit')
-    if nbit is None:
-        errorExit('<nbit> is missing')
-    qubo = problem.get('qubo')
-    if qubo is None:
-        errorExit('<qubo> is missing')
-    base = problem.get('base')
-    if base is None:
-        base = 0
+    try:
+        matrix = load_qubo(QUBOfile)
+    except ValueError as e:
+        errorExit(str(e))
+    nbit = matrix.nbit
 
     if isinstance(dup_normal, float):
         dup_normal = int(dup_normal*nbit)
     
-    if args.ratio2 is not None:
-        if isinstance(dup_normal2, float):
-            dup_normal2 = int(dup_normal2*nbit)
-
+    if isinstance(dup_normal2, float):
+        dup_normal2 = int(dup_normal2*nbit)
 
+    duplicated, record = duplicate_bits(matrix, dup_normal, duplicate_num, dup_normal2, duplicate_num2, penalty)
+    mapping1 = record['mapping normal']
+    mapping2 = record['mapping normal2']
 
-    # bit duplication + bit duplication
-    p = list(rand_select(nbit, dup_normal + dup_normal2))
-    p.sort()
-    p_normal = p[0:dup_normal]
-    p_normal2 = p[dup_normal:dup_normal + dup_normal2]
-    q_normal = {v: k for k, v in enumerate(p_normal)}
-    q_normal2 = {v: k for k, v in enumerate(p_normal2)}
-    mapping_normal = np.zeros((dup_normal, duplicate_num), int)
-    mapping_normal2 = np.zeros((dup_normal2, duplicate_num2), int)
-    W = defaultdict(int)
-
-
-    for x, y, v in qubo:
-        if v == 0:
-            continue
-        if x <= y:
-            W[(x, y)] = v
-        else:
-            W[(y, x)] = v
-
-    for i in range(dup_normal):
-        mapping_normal[i][0] = p[i]
-        for j in range(duplicate_num - 1):
-            W[(nbit + (duplicate_num - 1) * i + j, nbit + (duplicate_num - 1) * i + j)] = W[(p[i], p[i])]
-            mapping_normal[i][j + 1] = nbit + (duplicate_num - 1) * i + j
-    mapping1 = mapping_normal.tolist()
-
-    for i in range(dup_normal2):
-        mapping_normal2[i][0] = p[dup_normal + i]
-        for j in range(duplicate_num2 - 1):
-            W[(nbit + dup_normal * (duplicate_num - 1) + (duplicate_num2 - 1) * i + j,
-                nbit + dup_normal * (duplicate_num - 1) + (duplicate_num2 - 1) * i + j)] = W[(p[dup_normal + i], p[dup_normal + i])]
-            mapping_normal2[i][j + 1] = nbit + dup_normal * (duplicate_num - 1) + (duplicate_num2 - 1) * i + j
-    mapping2 = mapping_normal2.tolist()
-
-
-    # single rule
-    for i in range(dup_normal):
-        v = W.get((p_normal[i], p_normal[i]))
-
-        if v is None:
-            continue
-        r = rand_val(int(duplicate_num*(duplicate_num + 1)/2), v)
-        cnt = 0
-        for j in range(duplicate_num):
-            W[(mapping1[i][j], mapping1[i][j])] = r[cnt]
-            cnt += 1
-            if cnt < int(duplicate_num*(duplicate_num + 1)/2):
-                for k in range(j+1, duplicate_num):
-                    W[(mapping1[i][j], mapping1[i][k])] = r[cnt]
-                    cnt += 1
-
-    for i in range(dup_normal2):
-        v = W.get((p_normal2[i], p_normal2[i]))
-
-        if v is None:
-            continue
-        r = rand_val(int(duplicate_num2*(duplicate_num2 + 1)/2), v)
-        cnt = 0
-        for j in range(duplicate_num2):
-            W[(mapping2[i][j], mapping2[i][j])] = r[cnt]
-            cnt += 1
-            if cnt < int(duplicate_num2*(duplicate_num2 + 1)/2):
-                for k in range(j+1, duplicate_num2):
-                    W[(mapping2[i][j], mapping2[i][k])] = r[cnt]
-                    cnt += 1
-
-    # pair rule
-    for x, y, v in qubo:
-        if x == y:
-            continue
-        if x > y:
-            x, y = y, x
-        ix_normal, iy_normal = q_normal.get(x), q_normal.get(y)
-        ix_normal2, iy_normal2 = q_normal2.get(x), q_normal2.get(y)
-        if ix_normal is not None:
-            if iy_normal is not None:
-                r = rand_val(duplicate_num * duplicate_num, v)
-                k = 0
-                for i in range(duplicate_num):
-                    for j in range(duplicate_num):
-                        W[sort_pair(mapping1[ix_normal][i], mapping1[iy_normal][j])] = r[k]
-                        k += 1
-
-            else:
-                r = rand_val(duplicate_num, v)
-                for i in range(duplicate_num):
-                    W[sort_pair(mapping1[ix_normal][i], y)] = r[i]
-
-        elif iy_normal is not None:
-            r = rand_val(duplicate_num, v)
-            for i in range(duplicate_num):
-                W[sort_pair(x, mapping1[iy_normal][i])] = r[i]
-
-
-        if ix_normal2 is not None:
-            if iy_normal2 is not None:
-                r = rand_val(duplicate_num2 * duplicate_num2, v)
-                k = 0
-                for i in range(duplicate_num2):
-                    for j in range(duplicate_num2):
-                        W[sort_pair(mapping2[ix_normal2][i], mapping2[iy_normal2][j])] = r[k]
-                        k += 1
-
-            else:
-                r = rand_val(duplicate_num2, v)
-                for i in range(duplicate_num2):
-                    W[sort_pair(mapping2[ix_normal2][i], y)] = r[i]
-
-        elif iy_normal2 is not None:
-            r = rand_val(duplicate_num2, v)
-            for i in range(duplicate_num2):
-                W[sort_pair(x, mapping2[iy_normal2][i])] = r[i]
-
-
-        if ix_normal is not None:
-            if iy_normal2 is not None:
-                r = rand_val(duplicate_num * duplicate_num2, v)
-                k = 0
-                for i in range(duplicate_num):
-                    for j in range(duplicate_num2):
-                        W[sort_pair(mapping1[ix_normal][i], mapping2[iy_normal2][j])] = r[k]
-                        k += 1
-
-        if iy_normal is not None:
-            if ix_normal2 is not None:
-                r = rand_val(duplicate_num * duplicate_num2, v)
-                k = 0
-                for i in range(duplicate_num):
-                    for j in range(duplicate_num2):
-                        W[sort_pair(mapping1[iy_normal][i], mapping2[ix_normal2][j])] = r[k]
-                        k += 1
-
-    # 制約式を追加
-    #ペナルティを設定
-    if penalty is not None:
-        penalty_setting = penalty
-        for i in range(dup_normal):
-            for j in range(duplicate_num - 1):
-                W[sort_pair(mapping1[i][j], mapping1[i][j])] += penalty
-                W[sort_pair(mapping1[i][j + 1], mapping1[i][j + 1])] += penalty
-                W[sort_pair(mapping1[i][j], mapping1[i][j + 1])] -= 2 * penalty
-
-        for i in range(dup_normal2):
-            for j in range(duplicate_num2 - 1):
-                W[sort_pair(mapping2[i][j], mapping2[i][j])] += penalty
-                W[sort_pair(mapping2[i][j + 1], mapping2[i][j + 1])] += penalty
-                W[sort_pair(mapping2[i][j], mapping2[i][j + 1])] -= 2 * penalty
-    
-    #ペナルティを自動的に計算
-    else:
-        penalty_setting = []
-        adj = [[] for _ in range(nbit + (duplicate_num - 1) * dup_normal)]
-
-        for (x, y), v in W.items():
-            if x != y:
-                adj[x].append(y)
-                adj[y].append(x)
-
-        for i in range(nbit):
-            adj[i].sort()
-
-        for i in range(dup_normal):
-            dE = [0]*4
-            if W[(mapping1[i][0], mapping1[i][0])] is not None:
-                dE[0] = W[(mapping1[i][0], mapping1[i][0])]
-                dE[2] = W[(mapping1[i][0], mapping1[i][0])]
-            if W[(mapping1[i][1], mapping1[i][1])] is not None:
-                dE[1] = W[(mapping1[i][1], mapping1[i][1])]
-                dE[3] = W[(mapping1[i][1], mapping1[i][1])]
-            
-            # if flipping x0
-            for j in range(len(adj[mapping1[i][0]])):
-                if W[sort_pair(mapping1[i][0], adj[mapping1[i][0]][j])] > 0:
-                    dE[0] += W[sort_pair(mapping1[i][0], adj[mapping1[i][0]][j])]
-                elif W[sort_pair(mapping1[i][0], adj[mapping1[i][0]][j])] < 0:
-                    dE[2] += W[sort_pair(mapping1[i][0], adj[mapping1[i][0]][j])]
-            if W[(mapping1[i][0], mapping1[i][1])] < 0:
-                dE[0] += W[(mapping1[i][0], mapping1[i][1])]
-                dE[2] -= W[(mapping1[i][0], mapping1[i][1])]
-            dE[0] = -dE[0]
-
-            # if flipping x1
-            for j in range(len(adj[mapping1[i][1]])):
-                if W[sort_pair(mapping1[i][1], adj[mapping1[i][1]][j])] > 0:
-                    dE[1] += W[sort_pair(mapping1[i][1], adj[mapping1[i][1]][j])]
-                elif W[sort_pair(mapping1[i][1], adj[mapping1[i][1]][j])] < 0:
-                    dE[3] += W[sort_pair(mapping1[i][1], adj[mapping1[i][1]][j])]
-            if W[(mapping1[i][0], mapping1[i][1])] < 0:
-                dE[1] += W[(mapping1[i][0], mapping1[i][1])]
-                dE[3] -= W[(mapping1[i][0], mapping1[i][1])]
-            dE[1] = -dE[1]
-
-            penalty = abs(min(dE))
-
-            for j in range(duplicate_num - 1):
-                W[sort_pair(mapping1[i][j], mapping1[i][j])] += penalty
-                W[sort_pair(mapping1[i][j + 1], mapping1[i][j + 1])] += penalty
-                W[sort_pair(mapping1[i][j], mapping1[i][j + 1])] -= 2 * penalty
-            
-            penalty_setting.append(penalty)
-     
     if solfile is None:
         pass
     else:
         with open(solfile, "rt") as s:
             solutionfile = json.load(s)
         solution = solutionfile.get('solution')
-        for _ in range(dup_normal + dup_normal2):
-            solution.append(0)
-        for i in range(dup_normal):
-            solution[mapping1[i][1]] = solution[mapping1[i][0]]
-        for j in range(dup_normal2):
-            solution[mapping2[j][1]] = solution[mapping2[j][0]]
-
-    
+        solution += [0] * (duplicated.nbit - nbit)
+        for m in mapping1 + mapping2:
+            for x in m[1:]:
+                solution[x] = solution[m[0]]
 
     result = {'operation': 'bit duplication',
-                'nbit': nbit + (duplicate_num - 1) * dup_normal + (duplicate_num2 - 1) * dup_normal2, 'base': 0,
+                'nbit': duplicated.nbit, 'base': 0,
                 'duplicated_bits': dup_normal + dup_normal2}
-    result['normal duplicated'] = p_normal
-    result['normal2 duplicated'] = p_normal2
-    result['penalty'] = penalty_setting
-    result['mapping normal'] = mapping1
-    result['mapping normal2'] = mapping2
+    result.update(record)
     if solfile is not None:
         result['solution'] = solution
-    result['qubo'] = []
-    for x, y in sorted(W):
-        if W[(x, y)] != 0:
-            result['qubo'].append([x, y, int(W[(x, y)])])
-    del problem['qubo']
-    result['original'] = problem
-    jsonString = re.sub('[\r\n]\s+(-{0,1}\d+)\s*',
-                        '\\1', json.dumps(result, sort_keys=False, indent=4))
-    # print(jsonString)
-    with open(rf'{nbit}-{dup_normal + dup_normal2}-bit_duplication.json',
-                'w') as obj:
-        obj.write(jsonString)
+    result['qubo'] = duplicated.triples()
+    result['original'] = matrix.meta
+    write_json(result, rf'{nbit}-{dup_normal + dup_normal2}-bit_duplication.json')
 
 
 if __name__ == "__main__":
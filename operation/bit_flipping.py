@@ -1,10 +1,11 @@
 import random
 import argparse
-import json
-import re
 import sys
-import gzip
-from collections import defaultdict
+import os
+import numpy as np
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from common import QUBOMatrix, load_qubo, write_json
 
 
 def errorExit(s: str):
@@ -27,12 +28,48 @@ def rand_select(nbit: int, s=-1):
         pool[j] = pool[nbit-i-1]
 
 
+def flip_bits(matrix: QUBOMatrix, flist):
+    """flistのビットを反転 (X -> 1-X) したQUBO行列と定数項を返す．
+
+    COO形式の要素ごとに次の変換をまとめて行う．
+    W_{x,x}X_x (xを反転): W_{x,x} - W_{x,x}X_x
+    W_{x,y}X_x X_y (xだけを反転): W_{x,y}X_y - W_{x,y}X_x X_y
+    W_{x,y}X_x X_y (両方を反転): W_{x,y} - W_{x,y}X_x - W_{x,y}X_y + W_{x,y}X_x X_y
+
+    Args:
+        matrix (QUBOMatrix): 元の行列
+        flist: 反転するビットのリスト
+
+    Returns:
+        反転後の行列 (QUBOMatrix) と定数項offset (元のエネルギー = 反転後のエネルギー + offset)
+    """
+    nbit = matrix.nbit
+    row, col, val = matrix.row, matrix.col, matrix.val
+    flip = np.zeros(nbit, dtype=bool)
+    flip[np.asarray(flist, dtype=np.int64)] = True
+    flip_row = flip[row]
+    flip_col = flip[col]
+    diag = row == col
+    one = flip_row ^ flip_col  # 片方だけを反転 (対角成分は含まない)
+    both = flip_row & flip_col & ~diag
+
+    offset = int(val[diag & flip_row].sum()) + int(val[both].sum())
+    new_val = np.where(one | diag & flip_row, -val, val)
+    # 反転していない側の対角にW_{x,y}を加え，両方を反転した組は両端の対角からW_{x,y}を引く
+    free = np.where(flip_row, col, row)[one]
+    index = np.concatenate((free, row[both], col[both]))
+    delta = np.concatenate((val[one], -val[both], -val[both]))
+    flipped = QUBOMatrix.from_coo(nbit, np.concatenate((row, index)), np.concatenate((col, index)),
+                                  np.concatenate((new_val, delta)))
+    return flipped.eliminate_zeros(), offset
+
+
 def main():
 
     parser = argparse.ArgumentParser(
         description='Convert a QUBO problem by flipping bits')
     parser.add_argument(
-        '-Q', '--QUBOfile', help='QUBO problem file. must be .json/.json.gz. stdin if omitted')
+        '-Q', '--QUBOfile', help='QUBO problem file. must be .json/.json.gz/.qbin. stdin if omitted')
     parser.add_argument('-r', '--ratio', type=str, required=True,
                         help='# of flipping bits if integer flip ratio if float')
     parser.add_argument('-s', '--seed', type=int,
@@ -46,76 +83,25 @@ def main():
     else:
         flip = float(args.ratio)
 
-    if QUBOfile is None:
-        qubofile = sys.stdin
-    elif re.search('.json.gz$', QUBOfile, flags=re.IGNORECASE) is not None:
-        qubofile = gzip.open(QUBOfile, 'rt')
-    elif re.search('.json$', QUBOfile, flags=re.IGNORECASE) is not None:
-        qubofile = open(QUBOfile, 'rt')
-    else:
-        errorExit(f'QUBO Problem file must be .json or .json.gz')
-
-    problem = json.load(qubofile)
-    nbit = problem.get('nbit')
-    if nbit is None:
-        errorExit('<nbit> is missing')
-    qubo = problem.get('qubo')
-    if qubo is None:
-        errorExit('<qubo> is missing')
-    base = problem.get('base')
-    if base is None:
-        base = 0
-
+    try:
+        matrix = load_qubo(QUBOfile)
+    except ValueError as e:
+        errorExit(str(e))
+    nbit = matrix.nbit
 
     if isinstance(flip, float):
         flip = int(flip*nbit)
 
-    adj = [[] for _ in range(nbit)]  # 隣接リスト
-
-    W = defaultdict(int)
-    for x, y, v in qubo:  # 隣接リストの作成．自分自身は含まない
-        W[(x-base, y-base)] = v
-        if x != y:
-            adj[x-base].append(y-base)
-            adj[y-base].append(x-base)
-
-    for i in range(nbit):
-        adj[i].sort()
-
-    offset = 0
-
     flist = list(rand_select(nbit, flip))
     flist.sort()
-
-    for x in flist:  # x番目のビットをフリップ
-        v = W[(x, x)]  # W_{x,x}(1-X)= W_{x,x}-W_{x,x}X
-        offset += v  # 定数W_{x,x}
-        W[(x, x)] = -v  # -W_{x,x}を新たにW_{x,x}とする．
-        for y in adj[x]:
-            if x < y:
-                # W_{x,y}(1-X_x) X_y = W_{x,y}X_y - W_{x,y}X_x X_y
-                v = W[(x, y)]
-                W[(x, y)] = -v  # -W_{x,y}X_x X_y (代入)
-                W[(y, y)] += v  # W_{x,y}X_y (加算)
-            else:
-                v = W[(y, x)]
-                W[(y, x)] = -v
-                W[(y, y)] += v
+    flipped, offset = flip_bits(matrix, flist)
 
     result = {'operation': 'bit flipping',
               'nbit': nbit, 'base': 0, 'offset': offset}
     result['flipped'] = flist
-    result['qubo'] = []
-    for x, y in sorted(W):
-        if W[(x, y)] != 0:
-            result['qubo'].append([x, y, int(W[(x, y)])])
-    del problem['qubo']
-    result['original'] = problem
-    jsonString = re.sub('[\r\n]\s+(-{0,1}\d+)\s*',
-                        '\\1', json.dumps(result, sort_keys=False, indent=4))
-    #print(jsonString)
-    with open(rf'{nbit}-{flip}-flip.json', 'w') as obj:
-        obj.write(jsonString)
+    result['qubo'] = flipped.triples()
+    result['original'] = matrix.meta
+    write_json(result, rf'{nbit}-{flip}-flip.json')
 
 
 if __name__ == "__main__":
@@ -1,11 +1,13 @@
 import random
 import argparse
 import json
-import re
 import sys
-import gzip
-from collections import defaultdict
+import os
 import time
+import numpy as np
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from common import QUBOMatrix, load_qubo, write_json
 
 
 def errorExit(s: str):
@@ -33,31 +35,24 @@ def rand_select(nbit: int, s=-1):
         pool[j]=pool[nbit-i-1]
 
 
+def pop_random(pool: list):
+    """プールからランダムに1つ選び，末尾の要素をその位置に移して取り除く．"""
+    j = random.randrange(len(pool))
+    x = pool[j]
+    pool[j] = pool[-1]
+    pool.pop()
+    return x
+
+
 class QUBO:
 
-    def __init__(self, qubo, nbit):
-
-        self.W = defaultdict(int)
-        self.nbit = nbit
-        self.adj = [[] for _ in range(nbit)]
-        for x, y, v in qubo:
-            if v == 0:
-                continue
-            if x <= y:
-                self.W[(x, y)] = v
-                if x != y:
-                    self.adj[x].append(y)
-                    self.adj[y].append(x)
-            else:
-                self.W[(y, x)] = v
-                self.adj[x].append(y)
-                self.adj[y].append(x)
+    def __init__(self, matrix: QUBOMatrix):
+
+        self.nbit = matrix.nbit
+        self.matrix = matrix.eliminate_zeros()
 
-        for i in range(nbit):
-            self.adj[i].sort()
-        
 
-    def bit_reduction(self, reduction_num, solution_vector, total_01, selected_bits_idx):
+    def bit_reduction(self, reduction_num, solution_vector, total_01, selected_bits_idx, legacy_rng=False):
         self.reduction_num = reduction_num
         self.sol = solution_vector
         self.target_nbit = self.nbit - self.reduction_num
@@ -69,37 +64,101 @@ class QUBO:
         self.indices_0 = []
         self.indices_1 = []
         self.indices_01 = []
-        flag = {}
         if selected_bits_idx == -1:
             self.selected_bits_idx = []
-            bit_list = list(range(self.nbit))
         else:
             self.selected_bits_idx = selected_bits_idx
-            bit_list = [x for x in list(range(self.nbit)) if x not in selected_bits_idx]
-        num_01 = 0
-        selected_bits_num = 0
 
         for i in range(self.nbit):
             if self.sol[i] == 0:
                 self.all_0.append(i)
             else:
                 self.all_1.append(i)
-        real_indices_1 = self.all_1
+        if legacy_rng:
+            self.select_pairs_legacy()
+        else:
+            self.select_pairs()
+
+        self.indices_0 = sorted(self.indices_0, key=lambda x: x[0])
+        self.indices_1 = sorted(self.indices_1, key=lambda x: x[0])
+        self.indices_01 = sorted(self.indices_01, key=lambda x: x[0])
+        self.selected_bits_idx = sorted(self.selected_bits_idx)
+        # 元のインデックスでの(残すビット, 取り除くビット, 取り除くビットを反転するか)
+        self.merged_pairs = [(a, b, False) for a, b in self.indices_0 + self.indices_1]
+        self.merged_pairs += [(a, b, True) for a, b in self.indices_01]
+
+        num_0 = len(self.indices_0)
+        num_1 = len(self.indices_1)
+        num_01 = len(self.indices_01)
+        num_selected_bits = len(self.selected_bits_idx)
+        print('number of [1,1] bits: ', num_1)
+        print('number of [0,0] bits: ', num_0)
+        print('number of [0,1] bits: ', num_01)
+        print('total reduction number: ', num_selected_bits)
+        
+        # 取り除くビットbを残すビットaにまとめる．[0,1]の組ではbを反転してからまとめる (x_b = 1 - x_a)
+        self.reduced, offset, kept = QUBO.merge(self.matrix, self.merged_pairs)
+        self.offset += offset
+        new_index = np.cumsum(kept) - 1
+        self.selected_bits_idx = new_index[self.selected_bits_idx].tolist()
+        self.solution_after_reduction = (np.asarray(self.sol) != 0)[kept].astype(int).tolist()
+
+    def select_pairs(self) -> None:
+        """まとめるビットの組を選ぶ．
+
+        すでに選ばれたビットを除いて解が0のビットと1のビットを別々のプールに分け，
+        プールからの非復元抽出 (選んだ位置に末尾を移して取り除く) で選ぶので棄却が起きない．
+        [0,0]と[1,1]の組は，残りのビットから選んだ2ビットが等しい場合と同じ確率
+        (それぞれの組の数に比例) で選ぶ．
+        """
+        available = np.ones(self.nbit, dtype=bool)
+        available[self.selected_bits_idx] = False
+        sol = np.asarray(self.sol)
+        pool0 = np.flatnonzero(available & (sol == 0)).tolist()
+        pool1 = np.flatnonzero(available & (sol == 1)).tolist()
+
+        for _ in range(self.total_01):
+            if not pool0 or not pool1:
+                raise ValueError(f'not enough 0 and 1 bits for {self.total_01} [0,1] pairs')
+            x0 = pop_random(pool0)
+            x1 = pop_random(pool1)
+            self.indices_01.append([min(x0, x1), max(x0, x1)])
+            self.selected_bits_idx.append(min(x0, x1))
+
+        for _ in range(self.reduction_num - self.total_01):
+            n0 = len(pool0) * (len(pool0) - 1) // 2
+            n1 = len(pool1) * (len(pool1) - 1) // 2
+            if n0 + n1 == 0:
+                raise ValueError(f'not enough bits with the same value for {self.reduction_num - self.total_01} pairs')
+            if random.randrange(n0 + n1) < n0:
+                pool, indices = pool0, self.indices_0
+            else:
+                pool, indices = pool1, self.indices_1
+            x = pop_random(pool)
+            y = pop_random(pool)
+            indices.append([min(x, y), max(x, y)])
+            self.selected_bits_idx.append(min(x, y))
+
+    def select_pairs_legacy(self) -> None:
+        """以前の棄却による方法で組を選ぶ．同じ乱数の種に対して以前と同じ組を返す．"""
+        if self.selected_bits_idx:
+            bit_list = [x for x in list(range(self.nbit)) if x not in self.selected_bits_idx]
+        else:
+            bit_list = list(range(self.nbit))
+        total_01 = self.total_01
+        selected_bits_num = 0
+
         selected_0 = random.sample(self.all_0, total_01)
         selected_1 = random.sample(self.all_1, total_01)
         for i in range(total_01):
             if selected_0[i] < selected_1[i]:
                 self.indices_01.append([selected_0[i], selected_1[i]])
                 self.selected_bits_idx.append(selected_0[i])
-                flag[(selected_0[i], selected_1[i])] = [0, 1]
             else:
                 self.indices_01.append([selected_1[i], selected_0[i]])
                 self.selected_bits_idx.append(selected_1[i])
-                flag[(selected_1[i], selected_0[i])] = [1, 0]
             bit_list.remove(selected_0[i])
             bit_list.remove(selected_1[i])
-            sorted_flag = dict(sorted(flag.items(), key=lambda item: item[0][0]))
-            sorted_flag = list(sorted_flag.values())
 
         while selected_bits_num < self.reduction_num - total_01:
             selected_bits = random.sample(bit_list, 2)
@@ -124,237 +183,46 @@ class QUBO:
                 bit_list.remove(selected_bits[1])
                 selected_bits_num += 1
 
- 
-        
-        self.indices_0 = sorted(self.indices_0, key=lambda x: x[0])
-        self.indices_1 = sorted(self.indices_1, key=lambda x: x[0])
-        self.indices_01 = sorted(self.indices_01, key=lambda x: x[0])
-        self.selected_bits_idx = sorted(self.selected_bits_idx)
-
-        num_0 = len(self.indices_0)
-        num_1 = len(self.indices_1)
-        num_01 = len(self.indices_01)
-        num_selected_bits = len(self.selected_bits_idx)
-        print('number of [1,1] bits: ', num_1)
-        print('number of [0,0] bits: ', num_0)
-        print('number of [0,1] bits: ', num_01)
-        print('total reduction number: ', num_selected_bits)
-        
-        #[0,0] bit reduction
-        if num_0 > 0:
-            real_len = self.nbit
-            next_idx = 0
-            for k in range(num_0):
-                for i in range(real_len):
-                    total_val = 0
-                    if i not in self.indices_0[k]:
-                        for j in self.indices_0[k]:
-                            if self.W[sort_pair(i,j)] is not None:
-                                total_val += self.W[sort_pair(i,j)]
-                                del self.W[sort_pair(i,j)]
-                        if total_val != 0:
-                            self.W[sort_pair(i,self.indices_0[k][0])] = total_val
-                    elif i == self.indices_0[k][0]:
-                        for j in self.indices_0[k]:
-                            if self.W[sort_pair(i,j)] is not None:
-                                total_val += self.W[sort_pair(i,j)]
-                                del self.W[sort_pair(i,j)]
-                        if total_val != 0:
-                            self.W[sort_pair(i,i)] = total_val
-                    else:
-                        for j in self.indices_0[k]:
-                            if i <= j and self.W[(i,j)] is not None:
-                                total_val += self.W[(i,j)]
-                                del self.W[(i,j)]
-                        if total_val != 0 and self.W[(self.indices_0[k][0], self.indices_0[k][0])] is not None:
-                            self.W[(self.indices_0[k][0], self.indices_0[k][0])] += total_val
-                        elif total_val != 0 and self.W[(self.indices_0[k][0], self.indices_0[k][0])] is None:
-                            self.W[(self.indices_0[k][0], self.indices_0[k][0])] = total_val
-                    
-                for key in list(sorted(self.W.keys())):
-                    x, y = key
-                    if x > self.indices_0[k][1]:
-                        new_key = (x - 1, y - 1)
-                    elif x < self.indices_0[k][1] and y > self.indices_0[k][1]:
-                        new_key = (x, y - 1)
-                    else:
-                        new_key = key
-                    self.W[new_key] = self.W.pop(key)
-                
-                for i in range(len(real_indices_1)):
-                    if real_indices_1[i] > self.indices_0[k][1]:
-                        real_indices_1[i] -= 1 
-
-                if k != num_0 - 1:
-                    next_idx += 1
-                    for m in range(next_idx, num_0):
-                        if self.indices_0[m][0] > self.indices_0[k][1]:
-                            self.indices_0[m][0] -= 1
-                            self.indices_0[m][1] -= 1
-                        elif self.indices_0[m][0] < self.indices_0[k][1] and self.indices_0[m][1] > self.indices_0[k][1]:
-                            self.indices_0[m][1] -= 1
-                for m in range(num_1):
-                    if self.indices_1[m][0] > self.indices_0[k][1]:
-                        self.indices_1[m][0] -= 1
-                        self.indices_1[m][1] -= 1
-                    elif self.indices_1[m][0] < self.indices_0[k][1] and self.indices_1[m][1] > self.indices_0[k][1]:
-                        self.indices_1[m][1] -= 1
-                for m in range(num_01):
-                    if self.indices_01[m][0] > self.indices_0[k][1]:
-                        self.indices_01[m][0] -= 1
-                        self.indices_01[m][1] -= 1
-                    elif self.indices_01[m][0] < self.indices_0[k][1] and self.indices_01[m][1] > self.indices_0[k][1]:
-                        self.indices_01[m][1] -= 1
-                for m in range(num_selected_bits):
-                    if self.selected_bits_idx[m] > self.indices_0[k][1]:
-                        self.selected_bits_idx[m] -= 1
-                real_len -= 1
-        
-        #[1,1] bit reduction
-        if num_1 > 0:
-            real_len = self.nbit - num_0
-            next_idx = 0
-            for k in range(num_1):
-                for i in range(real_len):
-                    total_val = 0
-                    if i not in self.indices_1[k]:
-                        for j in self.indices_1[k]:
-                            if self.W[sort_pair(i,j)] is not None:
-                                total_val += self.W[sort_pair(i,j)]
-                                del self.W[sort_pair(i,j)]
-                        if total_val != 0:
-                            self.W[sort_pair(i,self.indices_1[k][0])] = total_val
-                    elif i == self.indices_1[k][0]:
-                        for j in self.indices_1[k]:
-                            if self.W[sort_pair(i,j)] is not None:
-                                total_val += self.W[sort_pair(i,j)]
-                                del self.W[sort_pair(i,j)]
-                        if total_val != 0:
-                            self.W[sort_pair(i,i)] = total_val
-                    else:
-                        for j in self.indices_1[k]:
-                            if i <= j and self.W[(i,j)] is not None:
-                                total_val += self.W[(i,j)]
-                                del self.W[(i,j)]
-                        if total_val != 0 and self.W[(self.indices_1[k][0], self.indices_1[k][0])] is not None:
-                            self.W[(self.indices_1[k][0], self.indices_1[k][0])] += total_val
-                        elif total_val != 0 and self.W[(self.indices_1[k][0], self.indices_1[k][0])] is None:
-                            self.W[(self.indices_1[k][0], self.indices_1[k][0])] = total_val
-                    
-                for key in list(sorted(self.W.keys())):
-                    x, y = key
-                    if x > self.indices_1[k][1]:
-                        new_key = (x - 1, y - 1)
-                    elif x < self.indices_1[k][1] and y > self.indices_1[k][1]:
-                        new_key = (x, y - 1)
-                    else:
-                        new_key = key
-                    self.W[new_key] = self.W.pop(key)
-
-                real_indices_1.remove(self.indices_1[k][1])
-                for i in range(len(real_indices_1)):
-                    if real_indices_1[i] > self.indices_1[k][1]:
-                        real_indices_1[i] -= 1
-
-                if k != num_1 - 1:
-                    next_idx += 1
-                    for m in range(next_idx, num_1):
-                        if self.indices_1[m][0] > self.indices_1[k][1]:
-                            self.indices_1[m][0] -= 1
-                            self.indices_1[m][1] -= 1
-                        elif self.indices_1[m][0] < self.indices_1[k][1] and self.indices_1[m][1] > self.indices_1[k][1]:
-                            self.indices_1[m][1] -= 1
-                for m in range(num_01):
-                    if self.indices_01[m][0] > self.indices_1[k][1]:
-                        self.indices_01[m][0] -= 1
-                        self.indices_01[m][1] -= 1
-                    elif self.indices_01[m][0] < self.indices_1[k][1] and self.indices_01[m][1] > self.indices_1[k][1]:
-                        self.indices_01[m][1] -= 1
-                for m in range(num_selected_bits):
-                    if self.selected_bits_idx[m] > self.indices_1[k][1]:
-                        self.selected_bits_idx[m] -= 1
-                real_len -= 1
-        
-
-        #[1,0] bit reduction
-        if num_01 > 0:
-            real_len = self.nbit - num_0 - num_1
-            next_idx = 0
-            for k in range(num_01):
-                #flip one bit in indices_01
-                v = self.W[(self.indices_01[k][1], self.indices_01[k][1])]
-                self.offset += v
-                self.W[(self.indices_01[k][1], self.indices_01[k][1])] = -v
-                edges_with_selected_0_bit = [key for key in self.W.keys() if self.indices_01[k][1] in key \
-                                                and key != (self.indices_01[k][1], self.indices_01[k][1])]
-                for edge in edges_with_selected_0_bit:
-                    v = self.W[edge]
-                    self.W[edge] = -v
-                    if self.indices_01[k][1] == edge[0]:
-                        self.W[(edge[1],edge[1])] += v
-                    else:
-                        self.W[(edge[0],edge[0])] += v
-
-                if sorted_flag[k][1] == 1:
-                    real_indices_1.remove(self.indices_01[k][1])
-                
-                self.indices_01[k].sort()
-                for i in range(real_len):
-                    total_val = 0
-                    if i not in self.indices_01[k]:
-                        for j in self.indices_01[k]:
-                            if self.W[sort_pair(i,j)] is not None:
-                                total_val += self.W[sort_pair(i,j)]
-                                del self.W[sort_pair(i,j)]
-                        if total_val != 0:
-                            self.W[sort_pair(i,self.indices_01[k][0])] = total_val
-                    elif i == self.indices_01[k][0]:
-                        for j in self.indices_01[k]:
-                            if self.W[sort_pair(i,j)] is not None:
-                                total_val += self.W[sort_pair(i,j)]
-                                del self.W[sort_pair(i,j)]
-                        if total_val != 0:
-                            self.W[sort_pair(i,i)] = total_val
-                    else:
-                        for j in self.indices_01[k]:
-                            if i <= j and self.W[(i,j)] is not None:
-                                total_val += self.W[(i,j)]
-                                del self.W[(i,j)]
-                        if total_val != 0 and self.W[(self.indices_01[k][0], self.indices_01[k][0])] is not None:
-                            self.W[(self.indices_01[k][0], self.indices_01[k][0])] += total_val
-                        elif total_val != 0 and self.W[(self.indices_01[k][0], self.indices_01[k][0])] is None:
-                            self.W[(self.indices_01[k][0], self.indices_01[k][0])] = total_val
-                    
-                for key in list(sorted(self.W.keys())):
-                    x, y = key
-                    if x > self.indices_01[k][1]:
-                        new_key = (x - 1, y - 1)
-                    elif x < self.indices_01[k][1] and y > self.indices_01[k][1]:
-                        new_key = (x, y - 1)
-                    else:
-                        new_key = key
-                    self.W[new_key] = self.W.pop(key)
-
-                for i in range(len(real_indices_1)):
-                    if real_indices_1[i] > self.indices_01[k][1]:
-                        real_indices_1[i] -= 1
-
-                if k != num_01 - 1:
-                    next_idx += 1
-                    for m in range(next_idx, num_01):
-                        if self.indices_01[m][0] > self.indices_01[k][1]:
-                            self.indices_01[m][0] -= 1
-                            self.indices_01[m][1] -= 1
-                        elif self.indices_01[m][0] < self.indices_01[k][1] and self.indices_01[m][1] > self.indices_01[k][1]:
-                            self.indices_01[m][1] -= 1
-                for m in range(num_selected_bits):
-                    if self.selected_bits_idx[m] > self.indices_01[k][1]:
-                        self.selected_bits_idx[m] -= 1
-                real_len -= 1
-        real_len = self.nbit - num_0 - num_1 - num_01
-        self.solution_after_reduction = [0]*real_len
-        for i in real_indices_1:
-            self.solution_after_reduction[i] += 1
+    @staticmethod
+    def merge(matrix: QUBOMatrix, merged_pairs):
+        """各組(a, b, flipped)についてx_bをx_a (flippedなら1 - x_a) で置き換え，bを除いて詰めた行列を返す．
+
+        x_i = alpha_i + beta_i y_i (alpha_i = 1, beta_i = -1は反転したビット) とおいて，
+        すべての要素をまとめて展開し，同じ要素を合計する．
+
+        Args:
+            matrix (QUBOMatrix): 元の行列
+            merged_pairs: (残すビット, 取り除くビット, 反転するか)のリスト (ビットは重複しない)
+
+        Returns:
+            まとめた行列 (QUBOMatrix)，定数項 (元のエネルギー = まとめた後のエネルギー + 定数項)，
+            残したビットのboolマスク
+        """
+        nbit = matrix.nbit
+        pairs = np.array([(a, b) for a, b, _ in merged_pairs], dtype=np.int64).reshape(-1, 2)
+        flipped = np.array([f for _, _, f in merged_pairs], dtype=bool)
+        rep = np.arange(nbit)
+        rep[pairs[:, 1]] = pairs[:, 0]
+        alpha = np.zeros(nbit, dtype=np.int64)
+        alpha[pairs[flipped, 1]] = 1
+        kept = np.ones(nbit, dtype=bool)
+        kept[pairs[:, 1]] = False
+        new_index = (np.cumsum(kept) - 1)[rep]
+
+        row, col, w = matrix.row, matrix.col, matrix.val
+        diag = row == col
+        a_row, a_col = alpha[row], alpha[col]
+        b_row, b_col = 1 - 2 * a_row, 1 - 2 * a_col
+        R, C = new_index[row], new_index[col]
+        # W_{r,r}x_r = W_{r,r}alpha_r + W_{r,r}beta_r y_r
+        # W_{r,c}x_r x_c = W_{r,c}(alpha_r alpha_c + alpha_r beta_c y_c + alpha_c beta_r y_r + beta_r beta_c y_r y_c)
+        offset = int((w * a_row)[diag].sum()) + int((w * a_row * a_col)[~diag].sum())
+        linear = np.concatenate((R[diag], C[~diag], R[~diag]))
+        row = np.concatenate((linear, R[~diag]))
+        col = np.concatenate((linear, C[~diag]))
+        val = np.concatenate(((w * b_row)[diag], (w * a_row * b_col)[~diag], (w * a_col * b_row)[~diag],
+                              (w * b_row * b_col)[~diag]))
+        return QUBOMatrix.from_coo(int(kept.sum()), row, col, val).eliminate_zeros(), offset, kept
         
 
 def main():
@@ -362,11 +230,13 @@ def main():
     parser = argparse.ArgumentParser(
         description='Bit reduction for reducing bits of QUBO problems')
     parser.add_argument(
-        '-Q', '--QUBOfile', type=str, help='QUBO problem file. must be .json/.json.gz. stdin if omitted')
+        '-Q', '--QUBOfile', type=str, help='QUBO problem file. must be .json/.json.gz/.qbin. stdin if omitted')
     parser.add_argument('-n', '--reduction_num', type=int, help='number of reduced bits') 
     parser.add_argument('-sol', '--Solutionfile', type=str, help='solution file.')
     parser.add_argument('-t', '--total_01_num', type=int, default=0, help='total number of 01 bits')
     parser.add_argument('-s', '--seed', type=int, default=0, help='Random seed')
+    parser.add_argument('--legacy-rng', action='store_true',
+                        help='select pairs by the old rejection sampling (reproduces the old choices for a seed)')
 
     args = parser.parse_args()
     random.seed(args.seed)
@@ -399,36 +269,18 @@ def main():
     print('number of 1 bits:',len(indices_1))
     print('number of 0 bits:',len(indices_0))
 
-    with open(QUBOfile, "rt") as f:
-        problem = json.load(f)
-        
-    
-    if QUBOfile is None:
-        qubofile = sys.stdin
-    elif re.search('.json.gz$', args.QUBOfile, flags=re.IGNORECASE) is not None:
-        qubofile = gzip.open(args.QUBOfile, 'rt')
-    elif re.search('.json$', args.QUBOfile, flags=re.IGNORECASE) is not None:
-        qubofile = open(args.QUBOfile, 'rt')
-    else:
-        errorExit(f'QUBO Problem file must be .json or .json.gz')
-
-    problem = json.load(qubofile)
-
-    nbit = problem.get('nbit')
-    if nbit is None:
-        errorExit('<nbit> is missing')
-    qubo = problem.get('qubo')
-    if qubo is None:
-        errorExit('<qubo> is missing')
-    base = problem.get('base')
-    if base is None:
-        base = 0
- 
-    
+    try:
+        matrix = load_qubo(QUBOfile)
+    except ValueError as e:
+        errorExit(str(e))
+    nbit = matrix.nbit
 
     start_time = time.time()
-    model = QUBO(qubo, nbit)
-    model.bit_reduction(reduction_num, solution_vector, total_01, selected_bits_idx)
+    model = QUBO(matrix)
+    try:
+        model.bit_reduction(reduction_num, solution_vector, total_01, selected_bits_idx, args.legacy_rng)
+    except ValueError as e:
+        errorExit(str(e))
 
     end_time = time.time()
     total_time = end_time - start_time
@@ -443,14 +295,8 @@ def main():
     result['number of 01 bits'] = model.total_01
     result['selected bits indices'] = model.selected_bits_idx
     result['solution'] = model.solution_after_reduction
-    result['qubo'] = []
-    for x, y in sorted(model.W):
-        if model.W[(x, y)] != 0:
-            result['qubo'].append([x, y, int(model.W[(x, y)])])    
-    jsonString = re.sub('[\r\n]\s+(-{0,1}\d+)\s*',
-                            '\\1', json.dumps(result, sort_keys=False, indent=4))
-    with open(rf'{nbit-reduction_num}-bit_reduction.json', 'w') as obj:
-        obj.write(jsonString)
+    result['qubo'] = model.reduced.triples()
+    write_json(result, rf'{nbit-reduction_num}-bit_reduction.json')
     
 
 
@@ -1,10 +1,11 @@
 import random
 import argparse
-import json
-import re
 import sys
-import gzip
-from collections import defaultdict
+import os
+import numpy as np
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from common import QUBOMatrix, load_qubo, write_json
 
 
 def errorExit(s: str):
@@ -26,54 +27,51 @@ def rand_select(nbit: int, s=-1):
         pool[j] = pool[nbit-i-1]
 
 
+def shuffle_bits(matrix: QUBOMatrix, p):
+    """ビットxをp[x]に移したQUBO行列を返す．
+
+    COO配列のインデックスをpでまとめて置き換え，(p[x], p[y])を上三角に正規化して辞書順に並べ直す．
+    置換なので同じ要素が重なることはない．
+
+    Args:
+        matrix (QUBOMatrix): 元の行列
+        p: 長さnbitの置換
+    """
+    p = np.asarray(p, dtype=np.int64)
+    return QUBOMatrix.from_coo(matrix.nbit, p[matrix.row], p[matrix.col], matrix.val).eliminate_zeros()
+
+
 def main():
     random.seed(0)
     parser = argparse.ArgumentParser(
         description='Randomly shuffle all elemnets of QUBO problems')
     parser.add_argument(
-        '-Q', '--QUBOfile', help='QUBO problem file. must be .json/.json.gz. stdin if omitted')
+        '-Q', '--QUBOfile', help='QUBO problem file. must be .json/.json.gz/.qbin. stdin if omitted')
     parser.add_argument('-s', '--seed', type=int,
                         default=0, help='Random seed')
+    parser.add_argument('-i', '--inverse', action='store_true',
+                        help='also write the inverse permutation (bit of the shuffled problem -> original bit)')
     args = parser.parse_args()
     random.seed(args.seed)
 
-    if args.QUBOfile is None:
-        qubofile = sys.stdin
-    elif re.search('.json.gz$', args.QUBOfile, flags=re.IGNORECASE) is not None:
-        qubofile = gzip.open(args.QUBOfile, 'rt')
-    elif re.search('.json$', args.QUBOfile, flags=re.IGNORECASE) is not None:
-        qubofile = open(args.QUBOfile, 'rt')
-    else:
-        errorExit(f'QUBO Problem file must be .json or .json.gz')
-
-    problem = json.load(qubofile)
-    nbit = problem.get('nbit')
-    if nbit is None:
-        errorExit('<nbit> is missing')
-    qubo = problem.get('qubo')
-    if qubo is None:
-        errorExit('<qubo> is missing')
-    base = problem.get('base')
-    if base is None:
-        base = 0
+    try:
+        matrix = load_qubo(args.QUBOfile)
+    except ValueError as e:
+        errorExit(str(e))
+    nbit = matrix.nbit
 
     p = list(rand_select(nbit))
-    W = {(p[x-base], p[y-base]): v for x, y, v in qubo}
+    shuffled = shuffle_bits(matrix, p)
 
     result = {'operation': 'bit shuffle',
               'nbit': nbit, 'base': 0}
     result['mapping'] = p
-    result['qubo'] = []
-    for x, y in sorted(W):
-        if W[(x, y)] != 0:
-            result['qubo'].append([x, y, int(W[(x, y)])])
-    del problem['qubo']
-    result['original'] = problem
-    jsonString = re.sub('[\r\n]\s+(-{0,1}\d+)\s*',
-                        '\\1', json.dumps(result, sort_keys=False, indent=4))
-    #print(jsonString)
-    with open(rf'{nbit}-shuffle.json', 'w') as obj:
-        obj.write(jsonString)
+    if args.inverse:
+        # シャッフル後の解yから元の解はx[i] = y[mapping[i]]，y[j] = x[inverse[j]]
+        result['inverse'] = np.argsort(p).tolist()
+    result['qubo'] = shuffled.triples()
+    result['original'] = matrix.meta
+    write_json(result, rf'{nbit}-shuffle.json')
 
 
 if __name__ == "__main__":
@@ -1,10 +1,14 @@
 from collections import defaultdict
 import argparse
 import json
-import re
 import random
+import sys
+import os
 import numpy as np
 
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from common import load_qubo, write_json
+
 
 
 
@@ -40,17 +44,12 @@ class Solution:
             self.solution = sol.get('solution')
             self.energy = sol.get('energy')
             self.nbit = len(self.solution)
-        with open(qubo_file) as file1:
-            self.W = defaultdict(int)
-            qubo = json.load(file1)
-            self.qubo = qubo.get('qubo')
-            for x, y, v in self.qubo:
-                if v == 0:
-                    continue
-                if x <= y:
-                    self.W[(x, y)] = v
-                else:
-                    self.W[(y, x)] = v
+        self.matrix = load_qubo(qubo_file).eliminate_zeros()
+        self.W = defaultdict(int, self.matrix.to_dict(base=0))
+        self.energy_computed = self.matrix.energy(self.solution)
+        if self.energy is not None and self.energy != self.energy_computed:
+            print(f'Warning: energy {self.energy} in {sol_file} differs from computed energy {self.energy_computed}',
+                  file=sys.stderr)
 
 class QUBO:
 
@@ -100,23 +99,19 @@ class QUBO:
         
         self.offset = cons_num*self.penalty
 
+    def write(self, cons_num, bit_num) -> None:
         jsonQUBO = {}
         jsonQUBO['problem'] = 'hard QUBO problem'
         jsonQUBO['nbit'] = self.nbit
         jsonQUBO['base'] = 0
         jsonQUBO['offset'] = self.offset
-        jsonQUBO['constraints'] = cons_group
+        jsonQUBO['constraints'] = self.cons_group.tolist()
         jsonQUBO['qubo'] = []
         for x, y in sorted(self.W):
             if self.W[(x, y)] != 0:
                 jsonQUBO['qubo'].append([x, y, int(self.W[(x, y)])])
  
-        jsonString = re.sub('[\r\n]\s+(-{0,1}\d+)\s*',
-                        '\\1', json.dumps(jsonQUBO, sort_keys=False, indent=4))
-        #print(jsonQUBO)
-        with open(rf'{self.nbit}-{cons_num}-{bit_num}-cons_add.json',
-                  'w') as obj:
-            obj.write(jsonString)
+        write_json(jsonQUBO, rf'{self.nbit}-{cons_num}-{bit_num}-cons_add.json')
 
 def main():
     parser = argparse.ArgumentParser(
@@ -136,6 +131,7 @@ def main():
     Sol.read(args.SolutionFile, args.QUBOFile)
     qubo = QUBO(Sol.solution, Sol.W, Sol.energy, Sol.nbit, penalty)
     qubo.add_cons(cons_num, bit_num)
+    qubo.write(cons_num, bit_num)
 
 
 if __name__ == "__main__":
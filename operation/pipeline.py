@@ -0,0 +1,224 @@
+import random
+import argparse
+import inspect
+import json
+import sys
+import os
+from collections import defaultdict
+import numpy as np
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from common import QUBOMatrix, load_qubo, write_json
+from bit_shuffling import rand_select, shuffle_bits
+from bit_flipping import flip_bits
+from bit_duplication import duplicate_bits
+from bit_reduction import QUBO as ReductionQUBO
+from cons_add import QUBO as ConstraintQUBO
+
+
+def errorExit(s: str):
+    """エラーメッセージを表示して強制終了
+
+    Args:
+        s (str): 表示するエラーメッセージ
+    """
+    print(s, file=sys.stderr)
+    sys.exit(1)
+
+
+def count(value: str, nbit: int) -> int:
+    """整数ならその数，小数ならnbitに対する割合としてビット数を返す．"""
+    if value.isdecimal():
+        return int(value)
+    return int(float(value)*nbit)
+
+
+class Pipeline:
+
+    def __init__(self, matrix: QUBOMatrix, solution=None):
+        """オペレーションを順にメモリ上で適用し，変換の記録を合成する
+
+        元の解xと変換後の解yは x[i] = y[source[i]] ^ negate[i] で対応し，
+        元のエネルギーは変換後のエネルギー + offset となる (制約の追加では制約を満たす解について)．
+
+        Args:
+            matrix (QUBOMatrix): 元の行列
+            solution: 元の問題の解 (reduce/consで使う．Noneなら解を追跡しない)
+        """
+        self.matrix = matrix
+        self.source = np.arange(matrix.nbit)
+        self.negate = np.zeros(matrix.nbit, dtype=bool)
+        self.offset = 0
+        self.steps = []
+        self.solution = None if solution is None else np.asarray(solution, dtype=np.int64)
+        if self.solution is not None and len(self.solution) != matrix.nbit:
+            raise ValueError(f'solution has {len(self.solution)} bits but QUBO has {matrix.nbit} bits')
+
+    def _update(self, matrix: QUBOMatrix, source, negate, offset, record: dict, solution=None) -> None:
+        """1つのオペレーションの結果を記録に合成する．
+
+        Args:
+            matrix (QUBOMatrix): オペレーション後の行列
+            source, negate: オペレーション前の解zとオペレーション後の解yの対応 z[j] = y[source[j]] ^ negate[j]
+            offset: オペレーションの定数項
+            record (dict): オペレーションの記録
+            solution: オペレーション後の解
+        """
+        self.negate = self.negate ^ np.asarray(negate, dtype=bool)[self.source]
+        self.source = np.asarray(source, dtype=np.int64)[self.source]
+        self.offset += offset
+        self.matrix = matrix
+        if self.solution is not None:
+            self.solution = np.asarray(solution, dtype=np.int64)
+        self.steps.append(record)
+
+    def _need_solution(self, name: str) -> None:
+        if self.solution is None:
+            raise ValueError(f'{name} needs a solution file (-sol)')
+
+    def shuffle(self) -> None:
+        nbit = self.matrix.nbit
+        p = list(rand_select(nbit))
+        solution = None
+        if self.solution is not None:
+            solution = np.empty(nbit, dtype=np.int64)
+            solution[p] = self.solution
+        self._update(shuffle_bits(self.matrix, p), p, np.zeros(nbit, dtype=bool), 0,
+                     {'operation': 'bit shuffle', 'nbit': nbit, 'mapping': p}, solution)
+
+    def flip(self, r: str) -> None:
+        nbit = self.matrix.nbit
+        flist = sorted(rand_select(nbit, count(r, nbit)))
+        matrix, offset = flip_bits(self.matrix, flist)
+        negate = np.zeros(nbit, dtype=bool)
+        negate[flist] = True
+        solution = None if self.solution is None else self.solution ^ negate
+        self._update(matrix, np.arange(nbit), negate, offset,
+                     {'operation': 'bit flipping', 'nbit': nbit, 'offset': offset, 'flipped': flist}, solution)
+
+    def duplicate(self, r1: str, n1: int, r2: str = None, n2: int = None, P: int = None) -> None:
+        nbit = self.matrix.nbit
+        dup_normal = count(r1, nbit)
+        dup_normal2 = 0 if r2 is None else count(r2, nbit)
+        matrix, record = duplicate_bits(self.matrix, dup_normal, n1, dup_normal2, 1 if n2 is None else n2, P)
+        solution = None
+        if self.solution is not None:
+            solution = np.zeros(matrix.nbit, dtype=np.int64)
+            solution[:nbit] = self.solution
+            for m in record['mapping normal'] + record['mapping normal2']:
+                solution[m[1:]] = self.solution[m[0]]
+        record = {'operation': 'bit duplication', 'nbit': matrix.nbit,
+                  'duplicated_bits': dup_normal + dup_normal2, **record}
+        self._update(matrix, np.arange(nbit), np.zeros(nbit, dtype=bool), 0, record, solution)
+
+    def reduce(self, n: int, t: int = 0) -> None:
+        self._need_solution('reduce')
+        nbit = self.matrix.nbit
+        model = ReductionQUBO(self.matrix)
+        model.bit_reduction(n, self.solution.tolist(), t, -1)
+        # 取り除いたビットは残したビット (反転したビットは反転した値) に対応させる
+        source = np.arange(nbit)
+        negate = np.zeros(nbit, dtype=bool)
+        kept = np.ones(nbit, dtype=bool)
+        for a, b, flipped in model.merged_pairs:
+            source[b] = a
+            negate[b] = flipped
+            kept[b] = False
+        source = (np.cumsum(kept) - 1)[source]
+        matrix = model.reduced
+        record = {'operation': 'bit reduction', 'nbit': matrix.nbit, 'reduction number': n,
+                  'offset': model.offset, 'number of 01 bits': t, 'selected bits indices': model.selected_bits_idx}
+        self._update(matrix, source, negate, model.offset, record, model.solution_after_reduction)
+
+    def cons(self, p: int, c: int, b: int) -> None:
+        self._need_solution('cons')
+        nbit = self.matrix.nbit
+        model = ConstraintQUBO(self.solution.tolist(), defaultdict(int, self.matrix.to_dict(base=0)), None, nbit, p)
+        model.add_cons(c, b)
+        if (model.cons_group < 0).any():
+            raise ValueError(f'not enough bits for {c} constraints of {b} bits')
+        matrix = QUBOMatrix.from_dict(nbit, model.W)
+        record = {'operation': 'constraint addition', 'nbit': nbit, 'offset': model.offset,
+                  'constraints': model.cons_group.tolist()}
+        self._update(matrix, np.arange(nbit), np.zeros(nbit, dtype=bool), model.offset, record, self.solution)
+
+    def result(self) -> dict:
+        """最終的な行列と合成した記録を出力用の辞書で返す．"""
+        result = {'operation': 'pipeline', 'nbit': self.matrix.nbit, 'base': 0, 'offset': self.offset}
+        result['operations'] = self.steps
+        result['mapping'] = self.source.tolist()
+        result['flipped'] = np.flatnonzero(self.negate).tolist()
+        if self.solution is not None:
+            result['solution'] = self.solution.tolist()
+        result['qubo'] = self.matrix.triples()
+        return result
+
+
+# オペレーション名 -> (Pipelineのメソッド, {パラメータ名: 型})
+OPERATIONS = {
+    'shuffle': (Pipeline.shuffle, {}),
+    'flip': (Pipeline.flip, {'r': str}),
+    'duplicate': (Pipeline.duplicate, {'r1': str, 'n1': int, 'r2': str, 'n2': int, 'P': int}),
+    'reduce': (Pipeline.reduce, {'n': int, 't': int}),
+    'cons': (Pipeline.cons, {'p': int, 'c': int, 'b': int}),
+}
+
+
+def parse_operation(spec: str):
+    """"name:key=value,key=value"形式のオペレーションを(メソッド, パラメータ)に変換する．"""
+    name, _, params = spec.partition(':')
+    if name not in OPERATIONS:
+        raise ValueError(f'unknown operation {name!r} (must be one of {", ".join(OPERATIONS)})')
+    method, types = OPERATIONS[name]
+    kwargs = {}
+    for item in filter(None, params.split(',')):
+        key, sep, value = item.partition('=')
+        if not sep or key not in types:
+            raise ValueError(f'invalid parameter {item!r} for {name} (parameters: {", ".join(types) or "none"})')
+        kwargs[key] = types[key](value)
+    try:
+        inspect.signature(method).bind(None, **kwargs)
+    except TypeError as e:
+        raise ValueError(f'{name}: {e}')
+    return method, kwargs
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description='Apply a sequence of operations to a QUBO problem in memory',
+        epilog='operations: shuffle, flip:r=R, duplicate:r1=R,n1=N[,r2=R,n2=N][,P=P], reduce:n=N[,t=T], '
+               'cons:p=P,c=C,b=B (R is # of bits if integer, ratio if float)')
+    parser.add_argument('operations', nargs='+', help='operations applied in order')
+    parser.add_argument(
+        '-Q', '--QUBOfile', help='QUBO problem file. must be .json/.json.gz/.mm/.mm.gz/.qbin. stdin if omitted')
+    parser.add_argument('-sol', '--solutionfile', type=str,
+                        help='solution file of the original problem (required by reduce and cons)')
+    parser.add_argument('-o', '--output', type=str, help='output file (default: <nbit>-pipeline.json)')
+    parser.add_argument('-s', '--seed', type=int,
+                        default=0, help='Random seed')
+    args = parser.parse_args()
+    random.seed(args.seed)
+
+    try:
+        operations = [parse_operation(spec) for spec in args.operations]
+        matrix = load_qubo(args.QUBOfile)
+        solution = None
+        if args.solutionfile is not None:
+            with open(args.solutionfile, 'rt') as f:
+                solution = json.load(f).get('solution')
+        pipeline = Pipeline(matrix, solution)
+        for method, kwargs in operations:
+            method(pipeline, **kwargs)
+    except ValueError as e:
+        errorExit(str(e))
+
+    result = pipeline.result()
+    result['original'] = matrix.meta
+    output = args.output
+    if output is None:
+        output = rf'{pipeline.matrix.nbit}-pipeline.json'
+    write_json(result, output)
+
+
+if __name__ == "__main__":
+    main()
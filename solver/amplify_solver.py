@@ -4,9 +4,11 @@ from amplify import BinaryIntMatrix
 import sys
 import gzip
 import argparse
-import re
-import tqdm
 import json
+import os
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from common import QUBOMatrix, read_qbin, read_mm, dump_json
 
 class QUBO:
 
@@ -47,42 +49,43 @@ class QUBO:
                 print(f'Error: Cannot open {fname}.', file=sys.stderr)
                 sys.exit(1)
             self.readJSON(file)
+        elif fname.lower().endswith('.qbin'):
+            try:
+                matrix = read_qbin(fname)
+            except (OSError, ValueError):
+                print(f'Error: Cannot open {fname}.', file=sys.stderr)
+                sys.exit(1)
+            self.setMatrix(matrix)
         else:
-            print(f'Error: {fname} must be .mm or .mm.gz', file=sys.stderr)
+            print(f'Error: {fname} must be .mm/.mm.gz, .json/.json.gz or .qbin', file=sys.stderr)
             sys.exit(1)
 
     def readMM(self, file):
-        m = re.match(r'(\d+)\s+(\d+)', file.readline())
-        self.nbit = int(m.group(1))
-        self.nelement = int(m.group(2))
-        self.base = 1
-        self.Q = {}
-        self.BIM = BinaryIntMatrix(self.nbit)
-        for i in tqdm.tqdm(range(self.nelement), desc='Reading', unit_scale=True):
-            x, y, w = map(lambda x: int(x), file.readline().split())
-            self.Q[(x, y)] = w
-            self.BIM[x-1, y-1] = w
+        self.setMatrix(read_mm(file))
 
     def readJSON(self, file):
-        jsonData = json.load(file)
-        self.nbit = jsonData['nbit']
-        self.nelement = len(jsonData['qubo'])
-        self.base = jsonData.get('base')
+        self.setMatrix(QUBOMatrix.from_problem(json.load(file)))
+
+    def setMatrix(self, matrix: QUBOMatrix):
+        self.matrix = matrix
+        self.nbit = matrix.nbit
+        self.nelement = matrix.nnz
+        self.base = matrix.base
+        self.makeBIM()
+
+    def makeBIM(self):
         self.BIM = BinaryIntMatrix(self.nbit)
-        if self.base is None:
-            self.base = 0
-        self.Q = {(x, y): w for x, y, w in jsonData['qubo']}
-        for x, y, w in jsonData['qubo']:
-            self.BIM[x-self.base, y-self.base] = w
+        for x, y, w in zip(self.matrix.row.tolist(), self.matrix.col.tolist(), self.matrix.val.tolist()):
+            self.BIM[x, y] = w
 
     def energy(self, solution):
-        return sum([solution[x-self.base]*solution[y-self.base]*self.Q[(x, y)] for x, y in self.Q.keys()])
+        return self.matrix.energy(solution)
 
 
 def main():
     parser = argparse.ArgumentParser(description='QUBO solver using Amplify')
     parser.add_argument(
-        'QUBOfile', help='QUBO file (mm/mm.gz or json/json.gz)')
+        'QUBOfile', help='QUBO file (mm/mm.gz, json/json.gz or qbin)')
     parser.add_argument('-o', '--output', default='result.json',
                         help='Soution file to be output')
     parser.add_argument('-t', '--time_limit', type=int, default=1,
@@ -114,13 +117,12 @@ def main():
     JSONdata['energy'] = first.energy
     JSONdata['energy_computed'] = inst.energy(solution)
     JSONdata['solution'] = solution
-    resultString = re.sub('[\r\n]\s+(-{0,1}\d+)\s*',
-                          '\\1', json.dumps(JSONdata, sort_keys=False, indent=4))
-
     with open(output, 'wt') as f:
-        print(resultString, file=f)
+        dump_json(JSONdata, f)
+        print(file=f)
 
-    print(resultString)
+    dump_json(JSONdata, sys.stdout)
+    print()
 
 
 if __name__ == "__main__":
@@ -1,10 +1,12 @@
 import gurobipy as gp
 from gurobipy import GRB
 import argparse
-import re
 import json
-import gzip
 import sys
+import os
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from common import load_qubo, dump_json
 
 def errorExit(message:str):
     print(message, file=sys.stderr)
@@ -22,33 +24,21 @@ parser.add_argument('-p', '--lp', type=str, help='LP file to be written')
 parser.add_argument('-o', '--output', type=str,
                     help='Solution (JSON) file to be written')
 parser.add_argument('-l', '--log', type=str, help='LOG file to be written')
-parser.add_argument('QUBO', help='QUBO problem JSON file')
+parser.add_argument('QUBO', help='QUBO problem file (json/json.gz or qbin)')
 
 args = parser.parse_args()
 
 if args.QUBO is None:
     errorExit('QUBO problem file is missing')
-if re.search('.json.gz$', args.QUBO, flags=re.IGNORECASE) is not None:
-    file = gzip.open(args.QUBO, 'rt')
-elif re.search('.json$', args.QUBO, flags=re.IGNORECASE) is not None:
-    file = open(args.QUBO, 'rt')
-else:
-    errorExit('QUBO problem must be .json or .json.gz')
-
 try:
-    problem = json.load(file)
-except:
+    matrix = load_qubo(args.QUBO)
+except json.JSONDecodeError:
     errorExit('QUBO file cannot be read as a JSON file')
+except ValueError as e:
+    errorExit(str(e))
 
-nbit = problem.get('nbit')
-if nbit is None:
-    errorExit('<nbit> is missing')
-qubo = problem.get('qubo')
-if qubo is None:
-    errorExit('<nbit> is missing')
-base = problem.get('base')
-if base is None:
-    base = 0
+nbit = matrix.nbit
+qubo = matrix.triples(nonzero=False).tolist()
 
 env = gp.Env()
 if args.log is not None:
@@ -63,7 +53,7 @@ model = gp.Model(env=env, name='QUBO')
 
 x = model.addVars(nbit, vtype=GRB.BINARY, name='x')
 
-model.setObjective(gp.quicksum(val * x[i-base] * x[j-base]
+model.setObjective(gp.quicksum(val * x[i] * x[j]
                    for i, j, val in qubo), sense=gp.GRB.MINIMIZE)
 
 if args.lp is not None:
@@ -84,10 +74,10 @@ if args.threads:
 result['solcount'] = model.SolCount
 result['GRB.OPTIMAL'] = gp.GRB.OPTIMAL
 result['solution'] = [int(v.X) for v in model.getVars()]
-jsonString = re.sub('[\r\n]\s*(-{0,1}\d+)\s*',
-                    '\\1', json.dumps(result, sort_keys=False, indent=4))
 if args.output:
     with open(args.output, 'wt') as f:
-        print(jsonString, file=f)
+        dump_json(result, f)
+        print(file=f)
 else:
-    print(jsonString)
+    dump_json(result, sys.stdout)
+    print()
@@ -1,11 +1,17 @@
 import openjij as oj
+import dimod
 import sys
 import gzip
 import argparse
-import re
-import tqdm
 import json
+import os
 import time
+import numpy as np
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from common import QUBOMatrix, read_qbin, read_mm, dump_json, read_seed, run_reads, best_read
+
+_READ_BLOCK = 32  # 1つのシードでまとめて実行する試行の数 (プロセス数によらず一定)
 
 class QUBO:
 
@@ -46,42 +52,83 @@ class QUBO:
                 print(f'Error: Cannot open {fname}.', file=sys.stderr)
                 sys.exit(1)
             self.readJSON(file)
+        elif fname.lower().endswith('.qbin'):
+            try:
+                matrix = read_qbin(fname)
+            except (OSError, ValueError):
+                print(f'Error: Cannot open {fname}.', file=sys.stderr)
+                sys.exit(1)
+            self.setMatrix(matrix)
         else:
-            print(f'Error: {fname} must be .mm or .mm.gz', file=sys.stderr)
+            print(f'Error: {fname} must be .mm/.mm.gz, .json/.json.gz or .qbin', file=sys.stderr)
             sys.exit(1)
 
     def readMM(self, file):
-        m = re.match(r'(\d+)\s+(\d+)', file.readline())
-        self.nbit = int(m.group(1))
-        self.nelement = int(m.group(2))
-        self.base = 1
-        self.Q = {}
-        for i in tqdm.tqdm(range(self.nelement), desc='Reading', unit_scale=True):
-            x, y, w = map(lambda x: int(x), file.readline().split())
-            self.Q[(x, y)] = w
+        self.setMatrix(read_mm(file))
 
     def readJSON(self, file):
-        jsonData = json.load(file)
-        self.nbit = jsonData['nbit']
-        self.nelement = len(jsonData['qubo'])
-        self.base = jsonData.get('base')
-        if self.base is None:
-            self.base = 0
+        self.setMatrix(QUBOMatrix.from_problem(json.load(file)))
 
-        self.Q = {(x, y): w for x, y, w in jsonData['qubo']}
+    def setMatrix(self, matrix: QUBOMatrix):
+        self.matrix = matrix
+        self.nbit = matrix.nbit
+        self.nelement = matrix.nnz
+        self.base = matrix.base
 
     def energy(self, solution):
-        return sum([solution[x-self.base]*solution[y-self.base]*self.Q[(x, y)] for x, y in self.Q.keys()])
+        return self.matrix.energy(solution)
+
+
+def to_bqm(matrix: QUBOMatrix) -> dimod.BinaryQuadraticModel:
+    """COO配列から0始まりのビットを変数とするBQMを作成する．
+
+    Args:
+        matrix (QUBOMatrix): QUBO行列
+    """
+    off = matrix.row != matrix.col
+    return dimod.BinaryQuadraticModel.from_numpy_vectors(
+        matrix.diagonal(), (matrix.row[off], matrix.col[off], matrix.val[off]), 0, dimod.BINARY,
+        variable_order=range(matrix.nbit))
+
+
+def sample_reads(matrix: QUBOMatrix, reads, seed: int, sqa: bool):
+    """試行を_READ_BLOCK個ずつのブロックに分け，ブロックごとにread_seedで決まるシードで
+    まとめて実行する (run_readsにはblock=_READ_BLOCKを渡す)．
+
+    BQMはワーカーごとに1回だけ作成し，すべてのブロックで使い回す．
+    エネルギーはサンプラーが返した値を使う．
+
+    Args:
+        matrix (QUBOMatrix): QUBO行列
+        reads: 試行の番号のリスト
+        seed (int): 全体のシード
+        sqa (bool): SQAを使うか
+    """
+    bqm = to_bqm(matrix)
+    sampler = oj.SQASampler() if sqa else oj.SASampler()
+    reads = np.asarray(reads)
+    samples = np.zeros((len(reads), matrix.nbit), dtype=np.uint8)
+    energies = np.zeros(len(reads), dtype=np.int64)
+    for b in np.unique(reads // _READ_BLOCK).tolist():
+        k = np.flatnonzero(reads // _READ_BLOCK == b)
+        response = sampler.sample(bqm, num_reads=len(k), seed=read_seed(seed, b))
+        samples[np.ix_(k, list(response.variables))] = response.record.sample
+        energies[k] = np.rint(response.record.energy)
+    return samples, energies
 
 
 def main():
     parser = argparse.ArgumentParser(description='QUBO solver using openJij')
     parser.add_argument(
-        'QUBOfile', help='QUBO file (mm/mm.gz or json/json.gz)')
+        'QUBOfile', help='QUBO file (mm/mm.gz, json/json.gz or qbin)')
     parser.add_argument('-o', '--output', default='result.json',
                         help='Solution file to be output')
     parser.add_argument('-n', '--num_reads', default=1, type=int, help='num_reads')
     parser.add_argument('-sqa', default=False, action='store_true')
+    parser.add_argument('-w', '--workers', default=1, type=int,
+                        help=f'number of processes. reads are seeded from --seed in fixed blocks of {_READ_BLOCK}, '
+                             'so the result does not depend on the number of processes')
+    parser.add_argument('--seed', type=int, help='random seed')
 
     args = parser.parse_args()
     output = args.output
@@ -89,33 +136,31 @@ def main():
     sqa = args.sqa
 
     inst = QUBO(args.QUBOfile)
-    if sqa:
-        sampler = oj.SQASampler(num_reads=num_reads)
-    else:
-        sampler = oj.SASampler(num_reads=num_reads)
-
+    seed = args.seed if args.seed is not None else np.random.SeedSequence().entropy
     start = time.time()
-    result = sampler.sample_qubo(inst.Q)
+    samples, energies = run_reads(sample_reads, inst.matrix, num_reads, args.workers, seed,
+                                  args=(sqa,), fname=args.QUBOfile, block=_READ_BLOCK)
     end = time.time()
+    best = best_read(energies)
+    energies = energies.tolist()
+    best_energy = energies[best]
+    solution = samples[best].tolist()
 
-    
-    solution = [int(i) for i in list(result.first.sample.values())]
     JSONdata = {}
     JSONdata['solver'] = 'OpenJij SQA' if sqa else 'OpenJij SA'
     JSONdata['nbit'] = inst.nbit
     JSONdata['num_reads']=num_reads
     JSONdata['time']=end-start
-    JSONdata['energies']=sorted(result.energies)
-    JSONdata['energy'] = int(result.first.energy)
+    JSONdata['energies']=sorted(energies)
+    JSONdata['energy'] = best_energy
     JSONdata['energy_computed'] = inst.energy(solution)
     JSONdata['solution'] = solution
-    resultString = re.sub('[\r\n]\s+(-{0,1}\d+)\s*',
-                          '\\1', json.dumps(JSONdata, sort_keys=False, indent=4))
-    
     with open(output, 'wt') as f:
-        print(resultString, file=f)
+        dump_json(JSONdata, f)
+        print(file=f)
 
-    print(resultString)
+    dump_json(JSONdata, sys.stdout)
+    print()
 
 
 if __name__ == "__main__":
@@ -0,0 +1,189 @@
+import argparse
+import os
+import sys
+import time
+
+import numpy as np
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from common import load_qubo, dump_json, run_reads, best_read
+
+
+def default_temperatures(matrix):
+    """初期温度と最終温度を返す．
+
+    最初は最大のエネルギー変化を1/2の確率で，最後は最小のエネルギー変化を1/100の確率で受理する温度とする．
+
+    Args:
+        matrix (QUBOMatrix): QUBO行列
+    """
+    indptr, indices, data = matrix.adjacency()
+    cs = np.zeros(len(data) + 1, dtype=np.int64)
+    np.cumsum(np.abs(data), out=cs[1:])
+    max_delta = int((np.abs(matrix.diagonal()) + cs[indptr[1:]] - cs[indptr[:-1]]).max(initial=0))
+    nz = np.abs(matrix.val[matrix.val != 0])
+    min_delta = int(nz.min()) if len(nz) > 0 else 1
+    if max_delta == 0:
+        max_delta = 1
+    return max_delta / np.log(2), min_delta / np.log(100)
+
+
+def make_schedule(T0: float, T1: float, sweeps: int, schedule: str = 'geometric'):
+    """各スイープの温度の配列を返す．
+
+    Args:
+        T0 (float): 初期温度
+        T1 (float): 最終温度
+        sweeps (int): スイープ数
+        schedule (str): 'geometric'なら温度を等比で，'linear'なら逆温度を等差で変化させる
+    """
+    t = np.linspace(0, 1, sweeps) if sweeps > 1 else np.ones(sweeps)
+    if schedule == 'geometric':
+        return T0 * (T1 / T0) ** t
+    if schedule == 'linear':
+        return 1 / (1 / T0 + (1 / T1 - 1 / T0) * t)
+    raise ValueError(f'unknown schedule: {schedule}')
+
+
+def read_rng(seed: int, read: int):
+    """read番目の試行の乱数生成器．試行をどう分割して実行しても同じ系列になる．"""
+    return np.random.default_rng(np.random.SeedSequence(seed, spawn_key=(read,)))
+
+
+def color_classes(matrix):
+    """CSR隣接構造のグラフを独立集合 (色クラス) に分け，SAの更新に使う構造をクラスごとに返す．
+
+    Jones-Plassmann法と同じく，未着色の隣接ビットより優先度の高い未着色のビットをまとめて
+    1つのクラスとし，すべてのビットが着色されるまで繰り返す．優先度は固定の乱数なので，
+    分け方は毎回同じになる．
+
+    Args:
+        matrix (QUBOMatrix): QUBO行列
+
+    Returns:
+        (bits, src, w, nbr, starts)のリスト．bitsはクラスのビット，src, wはその隣接要素を隣接ビット順に
+        並べたときのbits内の位置と重み ((m, 1)の配列)，nbrは重複を除いた隣接ビット，startsはnbrの
+        各ビットの要素の開始位置 (np.add.reduceat用)
+    """
+    n = matrix.nbit
+    indptr, indices, data = matrix.adjacency()
+    deg = np.diff(indptr)
+    priority = np.random.default_rng(0).permutation(n)
+    color = np.full(n, -1, dtype=np.int64)
+    ncolor = 0
+    while (color < 0).any():
+        p = np.where(color < 0, priority, -1)
+        neighbor_max = np.maximum.reduceat(np.append(p[indices], -1), indptr[:-1])
+        neighbor_max[deg == 0] = -1
+        chosen = (color < 0) & (priority > neighbor_max)
+        color[chosen] = ncolor
+        ncolor += 1
+    classes = []
+    for c in range(ncolor):
+        bits = np.flatnonzero(color == c)
+        cnt = deg[bits]
+        total = int(cnt.sum())
+        ent = np.arange(total) - np.repeat(np.cumsum(cnt) - cnt - indptr[bits], cnt)
+        src = np.repeat(np.arange(len(bits)), cnt)
+        nbr = indices[ent]
+        order = np.argsort(nbr, kind='stable')
+        src, nbr, w = src[order], nbr[order], data[ent][order]
+        starts = np.flatnonzero(np.r_[True, nbr[1:] != nbr[:-1]]) if total > 0 else np.zeros(0, dtype=np.int64)
+        classes.append((bits, src, w[:, None], nbr[starts], starts))
+    return classes
+
+
+def anneal(matrix, reads, seed: int, temperatures):
+    """複数の試行をまとめてSAを実行する．
+
+    各ビットの局所場を(nbit, 試行数)の配列で保持する．ビットは色クラス (互いに隣接しない
+    ビットの集合) ごとにまとめて反転を試み，反転したビットの隣接ビットの局所場だけを
+    1回の配列演算で更新する．
+
+    Args:
+        matrix (QUBOMatrix): QUBO行列
+        reads: 実行する試行の番号のリスト
+        seed (int): 乱数のシード
+        temperatures: 各スイープの温度
+
+    Returns:
+        (試行数, nbit)のuint8配列の解と，そのエネルギー
+    """
+    n = matrix.nbit
+    rngs = [read_rng(seed, r) for r in reads]
+    X = np.stack([rng.integers(0, 2, n, dtype=np.int8) for rng in rngs], axis=1)
+    H = np.ascontiguousarray(matrix.local_field(X.T).T)
+    classes = color_classes(matrix)
+    for T in temperatures:
+        # 受理の閾値 -T log(u) を試行ごとの乱数からまとめて作る
+        U = np.stack([rng.random(n) for rng in rngs], axis=1)
+        threshold = -T * np.log1p(-U)
+        for bits, src, w, nbr, starts in classes:
+            s = 1 - 2 * X[bits]
+            accept = s * H[bits] <= threshold[bits]
+            if not accept.any():
+                continue
+            X[bits] ^= accept
+            if len(src) > 0:
+                H[nbr] += np.add.reduceat((s * accept)[src] * w, starts, axis=0)
+    samples = X.T.astype(np.uint8)
+    return samples, matrix.energies(samples)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='QUBO solver using simulated annealing with NumPy')
+    parser.add_argument(
+        'QUBOfile', help='QUBO file (mm/mm.gz, json/json.gz or qbin)')
+    parser.add_argument('-o', '--output', default='result.json',
+                        help='Solution file to be output')
+    parser.add_argument('-n', '--num_reads', default=1, type=int, help='num_reads')
+    parser.add_argument('-s', '--sweeps', default=1000, type=int, help='number of sweeps')
+    parser.add_argument('--schedule', default='geometric', choices=['geometric', 'linear'],
+                        help='geometric in temperature or linear in inverse temperature')
+    parser.add_argument('--T0', type=float, help='initial temperature (estimated from QUBO if omitted)')
+    parser.add_argument('--T1', type=float, help='final temperature (estimated from QUBO if omitted)')
+    parser.add_argument('--seed', type=int, help='random seed')
+    parser.add_argument('-w', '--workers', default=1, type=int, help='number of processes to split reads across')
+
+    args = parser.parse_args()
+    output = args.output
+    num_reads = args.num_reads
+
+    try:
+        matrix = load_qubo(args.QUBOfile)
+    except ValueError as e:
+        print(f'Error: {e}', file=sys.stderr)
+        sys.exit(1)
+
+    T0, T1 = default_temperatures(matrix)
+    if args.T0 is not None:
+        T0 = args.T0
+    if args.T1 is not None:
+        T1 = args.T1
+    seed = args.seed if args.seed is not None else np.random.SeedSequence().entropy
+    temperatures = make_schedule(T0, T1, args.sweeps, args.schedule)
+
+    start = time.time()
+    samples, energies = run_reads(anneal, matrix, num_reads, args.workers, seed,
+                                  args=(temperatures,), fname=args.QUBOfile)
+    end = time.time()
+    best = best_read(energies)
+
+    JSONdata = {}
+    JSONdata['solver'] = 'NumPy SA'
+    JSONdata['nbit'] = matrix.nbit
+    JSONdata['num_reads'] = num_reads
+    JSONdata['time'] = end-start
+    JSONdata['energies'] = sorted(energies.tolist())
+    JSONdata['energy'] = int(energies[best])
+    JSONdata['solution'] = samples[best].tolist()
+    with open(output, 'wt') as f:
+        dump_json(JSONdata, f)
+        print(file=f)
+
+    dump_json(JSONdata, sys.stdout)
+    print()
+
+
+if __name__ == "__main__":
+    main()
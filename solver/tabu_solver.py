@@ -0,0 +1,186 @@
+import argparse
+import heapq
+import json
+import os
+import sys
+import time
+from collections import deque
+
+import numpy as np
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from common import load_qubo, dump_json
+
+_CHECK_INTERVAL = 256  # 時間制限を確認する反復の間隔
+
+
+class TabuSearch:
+
+    def __init__(self, matrix, tenure: int, stagnation: int, rng):
+        """1ビット反転のタブーサーチ
+
+        各ビットを反転したときのエネルギーの変化deltaを保持し，反転したビットの
+        隣接ビットのdeltaだけをCSR隣接構造から更新する．タブーでないビットは(delta, i)の
+        ヒープで管理し，deltaが変わった古い要素は取り出すときに捨てるので，1回の反転は
+        O(次数 log nbit)で済む．
+
+        Args:
+            matrix (QUBOMatrix): QUBO行列
+            tenure (int): 反転したビットを再び反転できない反復回数
+            stagnation (int): 最良解が改善しないまま続けたらリスタートする反復回数
+            rng: 乱数生成器
+        """
+        self.matrix = matrix
+        self.tenure = tenure
+        self.stagnation = stagnation
+        self.rng = rng
+        indptr, indices, data = matrix.adjacency()
+        self.neighbors = [(indices[indptr[i]:indptr[i + 1]], data[indptr[i]:indptr[i + 1]])
+                          for i in range(matrix.nbit)]
+
+    def run(self, x, deadline: float):
+        """xから探索し，最良解とそのエネルギーを返す．
+
+        Args:
+            x: 初期解
+            deadline (float): 打ち切る時刻 (time.time())
+        """
+        x = np.array(x, dtype=np.int8)
+        nbit = len(x)
+        delta = (1 - 2 * x) * self.matrix.local_field(x)
+        energy = self.matrix.energy(x)
+        best_x, best_energy = x.copy(), energy
+        tabu = np.full(nbit, -1, dtype=np.int64)
+        heap = list(zip(delta.tolist(), range(nbit)))
+        heapq.heapify(heap)
+        released = deque()  # (タブーが解ける反復, ビット) をタブーにした順に並べる
+        it = 0
+        last_improved = 0
+        while it - last_improved < self.stagnation:
+            if it % _CHECK_INTERVAL == 0 and time.time() >= deadline:
+                break
+            while released and released[0][0] <= it:
+                t, i = released.popleft()
+                if tabu[i] == t:
+                    heapq.heappush(heap, (int(delta[i]), i))
+            if len(heap) > 4 * nbit + 1024:
+                heap = [(int(delta[i]), i) for i in np.flatnonzero(tabu <= it).tolist()]
+                heapq.heapify(heap)
+            while heap and (tabu[heap[0][1]] > it or delta[heap[0][1]] != heap[0][0]):
+                heapq.heappop(heap)
+            # タブーでないビットの最小 (なければ-1) と，タブー中のビットを含めた最小
+            k = heap[0][1] if heap else -1
+            g = k
+            for t, i in released:
+                if tabu[i] == t and (g < 0 or (delta[i], i) < (delta[g], g)):
+                    g = i
+            if energy + delta[g] < best_energy:
+                k = g
+            elif k < 0:
+                break
+            d = int(delta[k])
+            s = 1 - 2 * int(x[k])
+            x[k] ^= 1
+            energy += d
+            delta[k] = -d
+            idx, w = self.neighbors[k]
+            if len(idx) > 0:
+                delta[idx] += (1 - 2 * x[idx].astype(np.int64)) * w * s
+                free = idx[tabu[idx] <= it]
+                for item in zip(delta[free].tolist(), free.tolist()):
+                    heapq.heappush(heap, item)
+            tabu[k] = it + self.tenure
+            released.append((tabu[k], k))
+            it += 1
+            if energy < best_energy:
+                best_x, best_energy = x.copy(), energy
+                last_improved = it
+        return best_x, best_energy
+
+    def solve(self, time_limit: float, restarts: int = None, init=None):
+        """時間制限までリスタートを繰り返し，各回の最良解とエネルギーを返す．
+
+        Args:
+            time_limit (float): 時間制限 (秒)
+            restarts (int): リスタートの回数 (Noneなら時間制限まで)
+            init: 最初の回の初期解 (Noneならランダム)
+        """
+        deadline = time.time() + time_limit
+        results = []
+        while not results or (time.time() < deadline and (restarts is None or len(results) <= restarts)):
+            if not results and init is not None:
+                x = init
+            else:
+                x = self.rng.integers(0, 2, self.matrix.nbit, dtype=np.int8)
+            results.append(self.run(x, deadline))
+        return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description='QUBO solver using one-flip tabu search')
+    parser.add_argument(
+        'QUBOfile', help='QUBO file (mm/mm.gz, json/json.gz or qbin)')
+    parser.add_argument('-o', '--output', default='result.json',
+                        help='Solution file to be output')
+    parser.add_argument('-t', '--time_limit', type=float, default=1,
+                        help='Maximum run time in seconds')
+    parser.add_argument('-r', '--restarts', type=int,
+                        help='number of restarts (restart until the time limit if omitted)')
+    parser.add_argument('--tenure', type=int, help='tabu tenure (min(20, nbit/4) if omitted)')
+    parser.add_argument('--stagnation', type=int,
+                        help='restart after this many iterations without improvement '
+                             '(max(1000, 10*nbit) if omitted)')
+    parser.add_argument('-i', '--init', help='result JSON whose solution is used as the initial solution')
+    parser.add_argument('--seed', type=int, help='random seed')
+
+    args = parser.parse_args()
+    output = args.output
+    time_limit = args.time_limit
+
+    try:
+        matrix = load_qubo(args.QUBOfile)
+    except ValueError as e:
+        print(f'Error: {e}', file=sys.stderr)
+        sys.exit(1)
+
+    init = None
+    if args.init is not None:
+        try:
+            with open(args.init, 'rt') as f:
+                init = json.load(f).get('solution')
+        except (OSError, ValueError):
+            print(f'Error: Cannot read {args.init}.', file=sys.stderr)
+            sys.exit(1)
+        if init is None or len(init) != matrix.nbit:
+            print(f'Error: {args.init} does not have a solution of {matrix.nbit} bits', file=sys.stderr)
+            sys.exit(1)
+
+    tenure = args.tenure if args.tenure is not None else max(1, min(20, matrix.nbit // 4))
+    stagnation = args.stagnation if args.stagnation is not None else max(1000, 10 * matrix.nbit)
+    tabu = TabuSearch(matrix, tenure, stagnation, np.random.default_rng(args.seed))
+
+    start = time.time()
+    results = tabu.solve(time_limit, args.restarts, init)
+    end = time.time()
+    energies = [e for _, e in results]
+    best = int(np.argmin(energies))
+
+    JSONdata = {}
+    JSONdata['solver'] = 'Tabu Search'
+    JSONdata['nbit'] = matrix.nbit
+    JSONdata['time_limit'] = time_limit
+    JSONdata['num_reads'] = len(results)
+    JSONdata['time'] = end-start
+    JSONdata['energies'] = sorted(energies)
+    JSONdata['energy'] = energies[best]
+    JSONdata['solution'] = results[best][0].tolist()
+    with open(output, 'wt') as f:
+        dump_json(JSONdata, f)
+        print(file=f)
+
+    dump_json(JSONdata, sys.stdout)
+    print()
+
+
+if __name__ == "__main__":
+    main()